@@ -1,8 +1,17 @@
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, filters
+import os
 import logging
+from datetime import date, datetime, timedelta
+from telegram.constants import ChatAction
 from config import config
-from database import db
+from database import adb, settings
+from broadcast import broadcaster
+from reports import reports
+from menu import menu
+from scheduler import scheduler
+from export import WRITERS, export_to_tempfile, xlsx_available
+from metrics import metrics
 
 # Состояния для админских ConversationHandler
 (
@@ -10,8 +19,26 @@ from database import db
     DELETE_CATEGORY, DELETE_SERVICE_SELECT, DELETE_SERVICE_CONFIRM,
     ADD_CATEGORY, ADD_SERVICE_NAME, ADD_SERVICE_PRICE, ADD_SERVICE_DURATION,
     EDIT_CHANNEL, EDIT_WEBSITE, EDIT_LOCATION_LAT, EDIT_LOCATION_LON,
-    EDIT_WELCOME, SEND_MESSAGE
-) = range(17)
+    EDIT_WELCOME, SEND_MESSAGE, REPORT_RANGE, EXPORT_FORMAT, SEARCH_QUERY,
+    SCHEDULE_TIME, SCHEDULE_MESSAGE
+) = range(22)
+
+# Ограничение Telegram на длину сообщения и число записей, выбираемых на страницу
+MESSAGE_LIMIT = 4096
+CLIENTS_PAGE_SIZE = 50
+# Триграммный индекс не ищет по строкам короче трёх символов
+SEARCH_MIN_LENGTH = 3
+# Сколько самых затратных обработчиков и запросов показывать в /stats
+STATS_TOP = 8
+
+ADMIN_PANEL_KEYBOARD = ReplyKeyboardMarkup([
+    ['Изменить услугу', 'Удалить услугу', 'Добавить услугу'],
+    ['Изменить ссылку на канал', 'Изменить ссылку на сайт', 'Изменить адрес'],
+    ['Изменить приветствие', 'Рассылка сообщения', 'Посмотреть клиентов'],
+    ['Посмотреть все записи', 'Скачать отчёт (PDF)', 'Статистика'],
+    ['Найти клиента', 'Экспорт клиентов', 'Отложенная рассылка'],
+    ['Назад']
+], resize_keyboard=True)
 
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.from_user.id not in config.ADMIN_IDS:
@@ -23,18 +50,10 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if key.startswith(('edit_', 'delete_', 'add_', 'new_')):
             context.user_data.pop(key, None)
     
-    keyboard = [
-        ['Изменить услугу', 'Удалить услугу', 'Добавить услугу'],
-        ['Изменить ссылку на канал', 'Изменить ссылку на сайт', 'Изменить адрес'],
-        ['Изменить приветствие', 'Рассылка сообщения', 'Посмотреть клиентов'],
-        ['Посмотреть все записи', 'Назад']
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    
     if update.message.text == '/admin':
-        await update.message.reply_text("Панель администратора:", reply_markup=reply_markup)
+        await update.message.reply_text("Панель администратора:", reply_markup=ADMIN_PANEL_KEYBOARD)
     else:
-        await update.message.reply_text("Панель администратора:", reply_markup=reply_markup)
+        await update.message.reply_text("Панель администратора:", reply_markup=ADMIN_PANEL_KEYBOARD)
     
     return ADMIN_MAIN
 
@@ -42,25 +61,25 @@ async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     
     if text == 'Изменить услугу':
-        keyboard = [['Маникюр', 'Педикюр', 'Наращивание'], ['Назад']]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text("Выберите категорию для редактирования:", reply_markup=reply_markup)
+        client_menu = await menu.get()
+        await update.message.reply_text("Выберите категорию для редактирования:", reply_markup=client_menu.admin_categories_keyboard)
         return EDIT_CATEGORY
     
     elif text == 'Удалить услугу':
-        keyboard = [['Маникюр', 'Педикюр', 'Наращивание'], ['Назад']]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text("Выберите категорию для удаления:", reply_markup=reply_markup)
+        client_menu = await menu.get()
+        await update.message.reply_text("Выберите категорию для удаления:", reply_markup=client_menu.admin_categories_keyboard)
         return DELETE_CATEGORY
     
     elif text == 'Добавить услугу':
-        keyboard = [['Маникюр', 'Педикюр', 'Наращивание'], ['Назад']]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text("Выберите категорию для добавления:", reply_markup=reply_markup)
+        client_menu = await menu.get()
+        await update.message.reply_text(
+            "Выберите категорию для добавления или введите название новой категории:",
+            reply_markup=client_menu.admin_categories_keyboard
+        )
         return ADD_CATEGORY
     
     elif text == 'Изменить ссылку на канал':
-        current_channel = db.get_setting('telegram_channel') or config.TELEGRAM_CHANNEL
+        current_channel = settings.get('telegram_channel') or config.TELEGRAM_CHANNEL
         await update.message.reply_text(
             f"Текущая ссылка на канал: {current_channel}\nВведите новую ссылку:",
             reply_markup=ReplyKeyboardRemove()
@@ -68,7 +87,7 @@ async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return EDIT_CHANNEL
     
     elif text == 'Изменить ссылку на сайт':
-        current_website = db.get_setting('website_url') or config.WEBSITE_URL
+        current_website = settings.get('website_url') or config.WEBSITE_URL
         await update.message.reply_text(
             f"Текущая ссылка на сайт: {current_website}\nВведите новую ссылку:",
             reply_markup=ReplyKeyboardRemove()
@@ -76,8 +95,8 @@ async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return EDIT_WEBSITE
     
     elif text == 'Изменить адрес':
-        current_lat = db.get_setting('location_lat') or config.LOCATION_LAT
-        current_lon = db.get_setting('location_lon') or config.LOCATION_LON
+        current_lat = settings.get('location_lat') or config.LOCATION_LAT
+        current_lon = settings.get('location_lon') or config.LOCATION_LON
         await update.message.reply_text(
             f"Текущие координаты: {current_lat}, {current_lon}\nВведите новую широту:",
             reply_markup=ReplyKeyboardRemove()
@@ -85,7 +104,7 @@ async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return EDIT_LOCATION_LAT
     
     elif text == 'Изменить приветствие':
-        current_welcome = db.get_setting('welcome_message') or 'Рады Вас видеть в нашей студии маникюра "Ноготочки-Точка"!'
+        current_welcome = settings.get('welcome_message') or 'Рады Вас видеть в нашей студии маникюра "Ноготочки-Точка"!'
         await update.message.reply_text(
             f"Текущее приветствие: {current_welcome}\nВведите новое приветственное сообщение:",
             reply_markup=ReplyKeyboardRemove()
@@ -99,16 +118,51 @@ async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return SEND_MESSAGE
     
+    elif text == 'Отложенная рассылка':
+        reply_markup = ReplyKeyboardMarkup([['Назад']], resize_keyboard=True)
+        await update.message.reply_text(
+            "Введите дату и время рассылки в формате ДД.ММ.ГГГГ ЧЧ:ММ:",
+            reply_markup=reply_markup
+        )
+        return SCHEDULE_TIME
+    
     elif text == 'Посмотреть клиентов':
-        clients = db.get_clients(30)
-        await send_clients_list(update, clients, "Клиенты за последние 30 дней:")
+        page_text, reply_markup = await render_clients_page(30)
+        await update.message.reply_text(page_text, reply_markup=reply_markup)
         return await admin_panel(update, context)
     
     elif text == 'Посмотреть все записи':
-        clients = db.get_clients(None)
-        await send_clients_list(update, clients, "Все клиенты:")
+        page_text, reply_markup = await render_clients_page(None)
+        await update.message.reply_text(page_text, reply_markup=reply_markup)
         return await admin_panel(update, context)
     
+    elif text == 'Скачать отчёт (PDF)':
+        keyboard = [['Сегодня', '7 дней', '30 дней'], ['Текущий месяц', 'Назад']]
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        await update.message.reply_text(
+            "Выберите период отчёта или введите его в формате ДД.ММ.ГГГГ-ДД.ММ.ГГГГ:",
+            reply_markup=reply_markup
+        )
+        return REPORT_RANGE
+    
+    elif text == 'Статистика':
+        await update.message.reply_text(await render_stats())
+        return await admin_panel(update, context)
+    
+    elif text == 'Найти клиента':
+        reply_markup = ReplyKeyboardMarkup([['Назад']], resize_keyboard=True)
+        await update.message.reply_text(
+            f"Введите имя или номер телефона клиента (не короче {SEARCH_MIN_LENGTH} символов):",
+            reply_markup=reply_markup
+        )
+        return SEARCH_QUERY
+    
+    elif text == 'Экспорт клиентов':
+        formats = ['CSV', 'XLSX'] if xlsx_available() else ['CSV']
+        reply_markup = ReplyKeyboardMarkup([formats, ['Назад']], resize_keyboard=True)
+        await update.message.reply_text("Выберите формат файла:", reply_markup=reply_markup)
+        return EXPORT_FORMAT
+    
     elif text == 'Назад':
         await update.message.reply_text("Возврат в главное меню.", reply_markup=ReplyKeyboardRemove())
         return ConversationHandler.END
@@ -117,17 +171,184 @@ async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Неизвестная команда. Используйте кнопки меню.")
         return ADMIN_MAIN
 
-async def send_clients_list(update, clients, title):
-    if clients:
-        message = f"{title}\n\n"
-        for client in clients:
-            message += f"ID: {client[0]}, Имя: {client[2]}, Телефон: {client[3]}, Услуга: {client[6] if len(client) > 6 else 'N/A'}, Дата: {client[5]}\n"
-        
-        # Разбиваем сообщение на части из-за ограничения длины в Telegram
-        for i in range(0, len(message), 4000):
-            await update.message.reply_text(message[i:i+4000])
+async def render_stats():
+    # Строится только по таблице агрегатов booking_stats_daily
+    today = date.today()
+    periods = [('Сегодня', today), ('7 дней', today - timedelta(days=6)), ('30 дней', today - timedelta(days=29))]
+    lines = ["Статистика записей:"]
+    rows = []
+    for title, start in periods:
+        rows = await adb.get_booking_stats(start.isoformat(), today.isoformat())
+        count = sum(row[2] for row in rows)
+        revenue = sum(row[3] for row in rows)
+        lines.append(f"{title}: {count} записей, {revenue} руб.")
+    
+    # После цикла в rows остаются данные за 30 дней
+    if not rows:
+        return "\n".join(lines)
+    
+    by_category = {}
+    for category, name, count, revenue in rows:
+        totals = by_category.setdefault(category or 'Удалённые услуги', [0, 0])
+        totals[0] += count
+        totals[1] += revenue
+    lines.append("\nПо категориям за 30 дней:")
+    for category, (count, revenue) in sorted(by_category.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{category}: {count} записей, {revenue} руб.")
+    
+    lines.append("\nПопулярные услуги за 30 дней:")
+    top = sorted(rows, key=lambda row: (-row[2], -row[3]))[:5]
+    for position, (category, name, count, revenue) in enumerate(top, 1):
+        lines.append(f"{position}. {name or 'Удалённая услуга'} — {count} записей, {revenue} руб.")
+    return "\n".join(lines)
+
+def format_timings(title, series, label):
+    # Сортируем по суммарному времени: частый быстрый запрос может стоить дороже редкого медленного
+    series = sorted(series, key=lambda item: -item[1].sum)[:STATS_TOP]
+    if not series:
+        return []
+    lines = [f"\n{title} (вызовов, среднее / p99, мс):"]
+    for labels, histogram in series:
+        count = histogram.count
+        if not count:
+            continue
+        lines.append(
+            f"{label(labels)}: {count}, "
+            f"{histogram.sum / count * 1000:.1f} / {histogram.quantile(0.99) * 1000:.1f}"
+        )
+    return lines
+
+def render_metrics():
+    lines = ["Производительность с момента запуска:"]
+    updates = metrics.histogram('bot_update_duration_seconds')
+    lines.append(
+        f"Обновлений: {updates.count}, p50 {updates.quantile(0.5) * 1000:.1f} мс, "
+        f"p99 {updates.quantile(0.99) * 1000:.1f} мс"
+    )
+    lag = metrics.histogram('bot_event_loop_lag_seconds')
+    lines.append(f"Задержка цикла событий p99: {lag.quantile(0.99) * 1000:.1f} мс")
+    
+    lines += format_timings(
+        "Обработчики", metrics.series('bot_handler_duration_seconds'),
+        lambda labels: f"{labels['handler']} [{labels['state']}]" if labels['state'] else labels['handler']
+    )
+    lines += format_timings("База данных", metrics.series('bot_db_call_duration_seconds'), lambda labels: labels['method'])
+    lines += format_timings("Bot API", metrics.series('bot_api_request_duration_seconds'), lambda labels: labels['method'])
+    
+    errors = [
+        (title, sum(value[0] for _, value in metrics.series(name)))
+        for title, name in [('обработчики', 'bot_handler_errors_total'), ('база', 'bot_db_errors_total'), ('Bot API', 'bot_api_errors_total')]
+    ]
+    lines.append("\nОшибки: " + ", ".join(f"{title} — {count}" for title, count in errors))
+    return "\n".join(lines)
+
+def format_client(client):
+    return f"ID: {client[0]}, Имя: {client[2]}, Телефон: {client[3]}, Услуга: {client[6] if len(client) > 6 else 'N/A'}, Дата: {client[5]}"
+
+def pack_records(records, limit):
+    """Группирует пары (запись, строка) в сообщения не длиннее limit, не разрывая записи."""
+    chunk, size = [], 0
+    for record, line in records:
+        if chunk and size + len(line) + 1 > limit:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append((record, line))
+        size += len(line) + 1
+    if chunk:
+        yield chunk
+
+def page_navigation(prefix, newer_cursor, older_cursor):
+    # Курсор передаётся в callback_data: "<prefix>:<направление>:<части курсора через двоеточие>"
+    buttons = []
+    if newer_cursor:
+        buttons.append(InlineKeyboardButton('◀️ Новее', callback_data=f"{prefix}:prev:{':'.join(map(str, newer_cursor))}"))
+    if older_cursor:
+        buttons.append(InlineKeyboardButton('Старее ▶️', callback_data=f"{prefix}:next:{':'.join(map(str, older_cursor))}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def render_page(fetch, title, empty_text, prefix, cursor_of, cursor=None, direction='next'):
+    """Страница записей с кнопками листания.
+    
+    fetch(cursor, direction, limit) выбирает строки keyset-пагинацией,
+    cursor_of(строка) — курсор строки для callback_data с префиксом prefix.
+    """
+    rows = await fetch(cursor, direction, CLIENTS_PAGE_SIZE + 1)
+    if not rows:
+        if cursor and direction == 'prev':
+            return await render_page(fetch, title, empty_text, prefix, cursor_of)
+        return empty_text, None
+    
+    records = ((row, format_client(row)) for row in rows[:CLIENTS_PAGE_SIZE])
+    page = next(pack_records(records, MESSAGE_LIMIT - len(title) - 2))
+    has_more = len(rows) > len(page)
+    if direction == 'prev':
+        # Более новые записи выбирались по возрастанию от курсора
+        page.reverse()
+        has_newer, has_older = has_more, True
     else:
-        await update.message.reply_text("Нет данных о клиентах.")
+        has_newer, has_older = cursor is not None, has_more
+    
+    first, last = page[0][0], page[-1][0]
+    reply_markup = page_navigation(
+        prefix,
+        cursor_of(first) if has_newer else None,
+        cursor_of(last) if has_older else None
+    )
+    text = f"{title}\n\n" + "\n".join(line for _, line in page)
+    return text, reply_markup
+
+async def edit_page(query, page):
+    # Листание заменяет текст того же сообщения
+    text, reply_markup = await page
+    await query.answer()
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+async def render_clients_page(days, cursor=None, direction='next'):
+    return await render_page(
+        lambda cursor, direction, limit: adb.get_clients_page(days, cursor, direction, limit),
+        f"Клиенты за последние {days} дней:" if days else "Все клиенты:",
+        "Нет данных о клиентах.",
+        f"clients:{days or 0}",
+        lambda row: (row[5], row[0]),
+        cursor, direction
+    )
+
+async def clients_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if query.from_user.id not in config.ADMIN_IDS:
+        await query.answer("Доступ запрещен.", show_alert=True)
+        return
+    
+    # clients:<дни>:<направление>:<created_at>:<id>
+    _, days, direction, rest = query.data.split(':', 3)
+    created_at, client_id = rest.rsplit(':', 1)
+    await edit_page(query, render_clients_page(int(days) or None, (created_at, int(client_id)), direction))
+
+async def render_search_page(query_text, cursor=None, direction='next'):
+    return await render_page(
+        lambda cursor, direction, limit: adb.search_clients(query_text, cursor, direction, limit),
+        f"Результаты поиска «{query_text}»:",
+        "Клиенты не найдены.",
+        'search',
+        lambda row: (row[0],),
+        cursor, direction
+    )
+
+async def search_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if query.from_user.id not in config.ADMIN_IDS:
+        await query.answer("Доступ запрещен.", show_alert=True)
+        return
+    
+    # Текст запроса не помещается в callback_data, поэтому хранится в user_data
+    query_text = context.user_data.get('search_query')
+    if not query_text:
+        await query.answer("Поиск устарел, выполните его заново.", show_alert=True)
+        return
+    
+    # search:<направление>:<id>
+    _, direction, client_id = query.data.split(':')
+    await edit_page(query, render_search_page(query_text, int(client_id), direction))
 
 # Редактирование услуг
 async def edit_category_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -136,12 +357,13 @@ async def edit_category_handler(update: Update, context: ContextTypes.DEFAULT_TY
     if text == 'Назад':
         return await admin_panel(update, context)
     
-    if text not in ['Маникюр', 'Педикюр', 'Наращивание']:
+    client_menu = await menu.get()
+    if text not in client_menu.categories:
         await update.message.reply_text("Пожалуйста, выберите категорию из предложенных вариантов.")
         return EDIT_CATEGORY
     
     context.user_data['edit_category'] = text
-    services = db.get_services_by_category(text)
+    services = await adb.get_services_by_category(text)
     
     if not services:
         keyboard = [['Назад']]
@@ -166,7 +388,7 @@ async def edit_service_select_handler(update: Update, context: ContextTypes.DEFA
     
     try:
         service_id = int(text.split(':')[0])
-        service = db.get_service_by_id(service_id)
+        service = await adb.get_service_by_id(service_id)
         if service:
             context.user_data['edit_service_id'] = service_id
             await update.message.reply_text(
@@ -209,7 +431,7 @@ async def edit_service_details_handler(update: Update, context: ContextTypes.DEF
         name = context.user_data['edit_service_name']
         price = context.user_data['edit_service_price']
         
-        db.update_service(service_id, name, price, duration)
+        await adb.update_service(service_id, name, price, duration)
         
         # Очищаем временные данные
         for key in ['edit_service_id', 'edit_service_name', 'edit_service_price', 'edit_category']:
@@ -225,12 +447,13 @@ async def delete_category_handler(update: Update, context: ContextTypes.DEFAULT_
     if text == 'Назад':
         return await admin_panel(update, context)
     
-    if text not in ['Маникюр', 'Педикюр', 'Наращивание']:
+    client_menu = await menu.get()
+    if text not in client_menu.categories:
         await update.message.reply_text("Пожалуйста, выберите категорию из предложенных вариантов.")
         return DELETE_CATEGORY
     
     context.user_data['delete_category'] = text
-    services = db.get_services_by_category(text)
+    services = await adb.get_services_by_category(text)
     
     if not services:
         keyboard = [['Назад']]
@@ -255,7 +478,7 @@ async def delete_service_select_handler(update: Update, context: ContextTypes.DE
     
     try:
         service_id = int(text.split(':')[0])
-        service = db.get_service_by_id(service_id)
+        service = await adb.get_service_by_id(service_id)
         if service:
             context.user_data['delete_service_id'] = service_id
             keyboard = [['Да, удалить', 'Нет, отменить']]
@@ -281,7 +504,7 @@ async def delete_service_confirm_handler(update: Update, context: ContextTypes.D
     if text == 'Да, удалить':
         service_id = context.user_data.get('delete_service_id')
         if service_id:
-            db.delete_service(service_id)
+            await adb.delete_service(service_id)
             await update.message.reply_text("✅ Услуга успешно удалена!", reply_markup=ReplyKeyboardMarkup([['/admin']], resize_keyboard=True))
         else:
             await update.message.reply_text("❌ Ошибка при удалении услуги.", reply_markup=ReplyKeyboardMarkup([['/admin']], resize_keyboard=True))
@@ -301,8 +524,10 @@ async def add_category_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     if text == 'Назад':
         return await admin_panel(update, context)
     
-    if text not in ['Маникюр', 'Педикюр', 'Наращивание']:
-        await update.message.reply_text("Пожалуйста, выберите категорию из предложенных вариантов.")
+    # Новая категория появится в меню клиентов вместе с первой услугой
+    text = text.strip()
+    if not text or text.startswith('/'):
+        await update.message.reply_text("Введите название категории.")
         return ADD_CATEGORY
     
     context.user_data['add_category'] = text
@@ -330,7 +555,7 @@ async def add_service_duration_handler(update: Update, context: ContextTypes.DEF
     name = context.user_data['add_service_name']
     price = context.user_data['add_service_price']
     
-    db.add_service(category, name, price, duration)
+    await adb.add_service(category, name, price, duration)
     
     # Очищаем временные данные
     for key in ['add_category', 'add_service_name', 'add_service_price']:
@@ -342,13 +567,13 @@ async def add_service_duration_handler(update: Update, context: ContextTypes.DEF
 # Редактирование настроек
 async def edit_channel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_channel = update.message.text
-    db.update_setting('telegram_channel', new_channel)
+    await adb.update_setting('telegram_channel', new_channel)
     await update.message.reply_text("✅ Ссылка на канал успешно обновлена!", reply_markup=ReplyKeyboardMarkup([['/admin']], resize_keyboard=True))
     return ConversationHandler.END
 
 async def edit_website_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_website = update.message.text
-    db.update_setting('website_url', new_website)
+    await adb.update_setting('website_url', new_website)
     await update.message.reply_text("✅ Ссылка на сайт успешно обновлена!", reply_markup=ReplyKeyboardMarkup([['/admin']], resize_keyboard=True))
     return ConversationHandler.END
 
@@ -367,8 +592,8 @@ async def edit_location_lon_handler(update: Update, context: ContextTypes.DEFAUL
         lon = float(update.message.text)
         lat = context.user_data['new_lat']
         
-        db.update_setting('location_lat', str(lat))
-        db.update_setting('location_lon', str(lon))
+        await adb.update_setting('location_lat', str(lat))
+        await adb.update_setting('location_lon', str(lon))
         
         context.user_data.pop('new_lat', None)
         await update.message.reply_text("✅ Координаты успешно обновлены!", reply_markup=ReplyKeyboardMarkup([['/admin']], resize_keyboard=True))
@@ -379,34 +604,151 @@ async def edit_location_lon_handler(update: Update, context: ContextTypes.DEFAUL
 
 async def edit_welcome_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_welcome = update.message.text
-    db.update_setting('welcome_message', new_welcome)
+    await adb.update_setting('welcome_message', new_welcome)
     await update.message.reply_text("✅ Приветственное сообщение успешно обновлено!", reply_markup=ReplyKeyboardMarkup([['/admin']], resize_keyboard=True))
     return ConversationHandler.END
 
 async def send_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message.text
-    clients = db.get_clients(None)
     
-    sent_count = 0
-    failed_count = 0
+    # Рассылка идёт в фоне, прогресс приходит администратору отдельным сообщением
+    broadcast_id = await broadcaster.start(context.bot, message, update.message.from_user.id)
     
-    from main import application
-    for client in clients:
-        try:
-            await application.bot.send_message(client[1], f"📢 Сообщение от администратора:\n\n{message}")
-            sent_count += 1
-        except Exception as e:
-            logging.error(f"Error sending message to client {client[1]}: {e}")
-            failed_count += 1
+    await update.message.reply_text(
+        f"📢 Рассылка №{broadcast_id} запущена.\n"
+        "Прогресс отправки будет обновляться в отдельном сообщении.",
+        reply_markup=ReplyKeyboardMarkup([['/admin']], resize_keyboard=True)
+    )
+    return ConversationHandler.END
+
+async def schedule_time_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text.strip()
+    
+    if text == 'Назад':
+        return await admin_panel(update, context)
+    
+    try:
+        run_at = datetime.strptime(text, '%d.%m.%Y %H:%M')
+    except ValueError:
+        await update.message.reply_text("Неверный формат. Пример: 25.12.2025 10:00")
+        return SCHEDULE_TIME
+    if run_at <= datetime.now():
+        await update.message.reply_text("Это время уже прошло. Введите время в будущем:")
+        return SCHEDULE_TIME
+    
+    context.user_data['new_broadcast_at'] = run_at
+    await update.message.reply_text(
+        f"Введите сообщение, которое будет разослано {run_at:%d.%m.%Y в %H:%M}:",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    return SCHEDULE_MESSAGE
+
+async def schedule_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    run_at = context.user_data.pop('new_broadcast_at', None)
+    if run_at is None:
+        return await admin_panel(update, context)
     
+    await scheduler.schedule('broadcast', run_at, {
+        'message': update.message.text,
+        'admin_id': update.message.from_user.id,
+    })
     await update.message.reply_text(
-        f"✅ Рассылка завершена!\n"
-        f"Успешно отправлено: {sent_count}\n"
-        f"Не удалось отправить: {failed_count}",
+        f"🕒 Рассылка запланирована на {run_at:%d.%m.%Y %H:%M}.",
         reply_markup=ReplyKeyboardMarkup([['/admin']], resize_keyboard=True)
     )
     return ConversationHandler.END
 
+def parse_report_range(text):
+    today = date.today()
+    presets = {
+        'Сегодня': (today, today),
+        '7 дней': (today - timedelta(days=6), today),
+        '30 дней': (today - timedelta(days=29), today),
+        'Текущий месяц': (today.replace(day=1), today),
+    }
+    if text in presets:
+        return presets[text]
+    
+    start_text, end_text = text.replace(' ', '').split('-')
+    start = datetime.strptime(start_text, '%d.%m.%Y').date()
+    end = datetime.strptime(end_text, '%d.%m.%Y').date()
+    if start > end:
+        raise ValueError("start after end")
+    return start, end
+
+async def report_range_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    
+    if text == 'Назад':
+        return await admin_panel(update, context)
+    
+    try:
+        start, end = parse_report_range(text)
+    except ValueError:
+        await update.message.reply_text("Неверный формат периода. Пример: 01.10.2025-31.10.2025")
+        return REPORT_RANGE
+    
+    await update.message.reply_chat_action(ChatAction.UPLOAD_DOCUMENT)
+    try:
+        pdf = await reports.get_pdf(start, end)
+    except Exception as e:
+        logging.error(f"Error building report for {start} - {end}: {e}")
+        await update.message.reply_text("❌ Не удалось сформировать отчёт.")
+        return await admin_panel(update, context)
+    
+    await update.message.reply_document(
+        pdf,
+        filename=f"report_{start:%Y%m%d}_{end:%Y%m%d}.pdf",
+        caption=f"Отчёт за {start:%d.%m.%Y} — {end:%d.%m.%Y}"
+    )
+    return await admin_panel(update, context)
+
+async def export_format_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    
+    if text == 'Назад':
+        return await admin_panel(update, context)
+    
+    fmt = text.lower()
+    if fmt not in WRITERS:
+        await update.message.reply_text("Выберите формат кнопкой меню.")
+        return EXPORT_FORMAT
+    
+    await update.message.reply_chat_action(ChatAction.UPLOAD_DOCUMENT)
+    try:
+        path, filename, count = await export_to_tempfile(fmt)
+    except Exception as e:
+        logging.error(f"Error exporting clients to {fmt}: {e}")
+        await update.message.reply_text("❌ Не удалось выгрузить клиентов.")
+        return await admin_panel(update, context)
+    
+    try:
+        with open(path, 'rb') as document:
+            await update.message.reply_document(document, filename=filename, caption=f"Выгружено записей: {count}")
+    finally:
+        os.remove(path)
+    return await admin_panel(update, context)
+
+async def search_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text.strip()
+    
+    if text == 'Назад':
+        return await admin_panel(update, context)
+    
+    if len(text) < SEARCH_MIN_LENGTH:
+        await update.message.reply_text(f"Запрос должен быть не короче {SEARCH_MIN_LENGTH} символов.")
+        return SEARCH_QUERY
+    
+    context.user_data['search_query'] = text
+    try:
+        page_text, reply_markup = await render_search_page(text)
+    except Exception as e:
+        logging.error(f"Error searching clients for {text!r}: {e}")
+        page_text, reply_markup = "❌ Не удалось выполнить поиск.", None
+    await update.message.reply_text(page_text, reply_markup=reply_markup)
+    # Остаёмся в режиме поиска: можно сразу ввести следующий запрос
+    return SEARCH_QUERY
+
 async def admin_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Очищаем все временные данные
     for key in list(context.user_data.keys()):
@@ -417,4 +759,11 @@ async def admin_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "❌ Действие отменено.",
         reply_markup=ReplyKeyboardMarkup([['/admin']], resize_keyboard=True)
     )
-    return ConversationHandler.END
\ No newline at end of file
+    return ConversationHandler.END
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.from_user.id not in config.ADMIN_IDS:
+        await update.message.reply_text("Доступ запрещен.")
+        return
+    
+    await update.message.reply_text(render_metrics()[:MESSAGE_LIMIT])
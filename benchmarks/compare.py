@@ -0,0 +1,71 @@
+"""Сравнение двух сохранённых прогонов benchmarks.run.
+
+    python3 -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+
+Код возврата 1, если задержка или число запросов выросли больше порога.
+"""
+import sys
+import json
+import argparse
+
+# Метрики, рост которых считается ухудшением; пропускная способность — наоборот
+LOWER_IS_BETTER = ['p50_ms', 'p90_ms', 'p99_ms', 'queries_per_update', 'api_calls_per_update']
+HIGHER_IS_BETTER = ['throughput']
+# Подсказки о регрессии только для метрик, устойчивых между прогонами
+GATED = ['p50_ms', 'p99_ms', 'queries_per_update']
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def change(old, new):
+    if not old:
+        return 0.0 if not new else float('inf')
+    return (new - old) / old * 100
+
+def compare(baseline, candidate, threshold, min_delta_ms):
+    regressions = []
+    rows = []
+    for flow in sorted(set(baseline['flows']) | set(candidate['flows'])):
+        old, new = baseline['flows'].get(flow), candidate['flows'].get(flow)
+        if old is None or new is None:
+            rows.append([flow, 'только в одном прогоне', '', '', ''])
+            continue
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            delta = change(old[metric], new[metric])
+            worse = -delta if metric in HIGHER_IS_BETTER else delta
+            mark = ''
+            # Доли миллисекунды между прогонами — шум планировщика, а не регрессия
+            noise = metric.endswith('_ms') and abs(new[metric] - old[metric]) < min_delta_ms
+            if metric in GATED and worse > threshold and not noise:
+                mark = 'REGRESSION'
+                regressions.append((flow, metric, delta))
+            rows.append([flow, metric, str(old[metric]), str(new[metric]), f"{delta:+.1f}% {mark}".rstrip()])
+    return rows, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сравнение результатов двух прогонов')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='допустимое ухудшение, %%')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='изменение задержки меньше этого не считается регрессией')
+    args = parser.parse_args(argv)
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    for key in ('services', 'clients', 'users', 'concurrency', 'api_latency_ms'):
+        if baseline['meta'].get(key) != candidate['meta'].get(key):
+            print(f"Warning: runs differ in {key}: {baseline['meta'].get(key)} vs {candidate['meta'].get(key)}")
+
+    rows, regressions = compare(baseline, candidate, args.threshold, args.min_delta_ms)
+    headers = ['flow', 'metric', baseline['meta'].get('revision') or 'baseline', candidate['meta'].get('revision') or 'candidate', 'change']
+    widths = [max(len(row[i]) for row in rows + [headers]) for i in range(len(headers))]
+    for row in [headers] + rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+    if regressions:
+        print(f"\n{len(regressions)} regressions above {args.threshold:g}%")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import json
+import time
+import asyncio
+import itertools
+from collections import Counter
+from telegram.request import BaseRequest
+
+BOT_USER = {
+    'id': 1000000,
+    'is_bot': True,
+    'first_name': 'Benchmark',
+    'username': 'benchmark_bot',
+    'can_join_groups': False,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+
+# Методы, которые возвращают отправленное сообщение
+MESSAGE_METHODS = {
+    'sendMessage', 'sendLocation', 'sendDocument', 'editMessageText', 'copyMessage',
+}
+
+class FakeBotAPI(BaseRequest):
+    """Подменяет HTTP-клиент Bot API: отвечает правдоподобными данными без сети.
+
+    Запоминает число вызовов по методам и последнюю клавиатуру в каждом чате,
+    чтобы сценарии могли нажимать кнопки, которые бот действительно показал.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.keyboards = {}
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        name = url.rsplit('/', 1)[-1]
+        self.calls[name] += 1
+        parameters = request_data.parameters if request_data else {}
+        if self.latency:
+            # Задержка настоящего Bot API, чтобы учесть ожидание сети в конкурентных сценариях
+            await asyncio.sleep(self.latency)
+
+        if name == 'getMe':
+            result = BOT_USER
+        elif name in MESSAGE_METHODS:
+            result = self._message(parameters)
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def _message(self, parameters):
+        chat_id = int(parameters.get('chat_id', 0))
+        markup = parameters.get('reply_markup')
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        if isinstance(markup, dict) and 'keyboard' in markup:
+            self.keyboards[chat_id] = [
+                [button['text'] if isinstance(button, dict) else button for button in row]
+                for row in markup['keyboard']
+            ]
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': parameters.get('text', ''),
+        }
+
+    def reset(self):
+        self.calls.clear()
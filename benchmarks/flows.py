@@ -0,0 +1,56 @@
+import time
+import itertools
+
+_update_ids = itertools.count(1)
+
+def message_update(user_id, text, first_name='Клиент'):
+    """Обновление с текстовым сообщением в личном чате, как его присылает Telegram."""
+    update_id = next(_update_ids)
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private', 'first_name': first_name},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': first_name},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+def button(row=0, column=0):
+    """Шаг сценария: нажать кнопку из последней клавиатуры, которую бот показал в чате."""
+    def pick(api, user_id):
+        keyboard = api.keyboards.get(user_id) or [['Назад']]
+        row_index = min(row, len(keyboard) - 1)
+        return keyboard[row_index][min(column, len(keyboard[row_index]) - 1)]
+    return pick
+
+def phone(api, user_id):
+    return f"+7 (9{user_id % 100:02d}) {user_id % 10000000:07d}"
+
+# Сценарий — последовательность шагов одного пользователя; admin=True берёт id из ADMIN_IDS
+FLOWS = {
+    # Главное меню, категория, возврат и адрес студии
+    'client_browse': {
+        'admin': False,
+        'steps': ['/start', button(0, 0), 'Назад', 'Адрес студии'],
+    },
+    # Полная запись: категория, услуга, телефон, первый свободный слот
+    'client_booking': {
+        'admin': False,
+        'steps': ['/start', button(0, 0), button(0, 0), phone, button(0, 0)],
+    },
+    # Список клиентов и статистика из агрегатов
+    'admin_clients': {
+        'admin': True,
+        'steps': ['/admin', 'Посмотреть клиентов', 'Статистика', 'Назад'],
+    },
+    # Поиск клиента по имени и по телефону
+    'admin_search': {
+        'admin': True,
+        'steps': ['/admin', 'Найти клиента', 'Анна', '912', 'Назад'],
+    },
+}
+
+def resolve(step, api, user_id):
+    return step(api, user_id) if callable(step) else step
@@ -0,0 +1,263 @@
+"""Нагрузочный прогон обработчиков бота против поддельного Bot API.
+
+Запуск из корня проекта:
+
+    python3 -m benchmarks.run --clients 50000 --users 50 --concurrency 10
+
+Результат печатается таблицей и сохраняется в benchmarks/results/<время>.json;
+два сохранённых прогона сравнивает benchmarks.compare.
+"""
+import os
+import sys
+import json
+import logging
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+CATEGORIES = ['Маникюр', 'Педикюр', 'Наращивание', 'Брови', 'Ресницы', 'Макияж']
+NAMES = ['Анна', 'Мария', 'Екатерина', 'Ольга', 'Светлана', 'Ирина', 'Наталья', 'Елена']
+DURATIONS = ['30 минут', '1 час', '1.5 часа', '2 часа', '3 часа']
+# id клиентов из базы и пользователей сценариев не пересекаются
+SEEDED_CUSTOMER_BASE = 10_000_000
+FLOW_USER_BASE = 200_000
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон сценариев бота')
+    parser.add_argument('--services', type=int, default=30, help='число услуг в каталоге')
+    parser.add_argument('--clients', type=int, default=20000, help='число записей клиентов в базе')
+    parser.add_argument('--users', type=int, default=50, help='пользователей на сценарий')
+    parser.add_argument('--concurrency', type=int, default=10, help='пользователей одновременно')
+    parser.add_argument('--flows', nargs='*', help='какие сценарии запускать (по умолчанию все)')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа Bot API, мс')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора данных')
+    parser.add_argument('--label', default='', help='подпись прогона в файле результатов')
+    parser.add_argument('--output', default=RESULTS_DIR, help='каталог для результатов')
+    return parser.parse_args(argv)
+
+def configure_environment(args, db_path):
+    # Настройки читаются при импорте config, поэтому выставляются до импорта модулей бота
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['BOT_TOKEN'] = '123456:BENCHMARK'
+    os.environ['ADMIN_IDS'] = ','.join(str(user_id) for user_id in range(1, args.users + 1))
+    os.environ['NOTIFY_DIGEST_WINDOW'] = '0'
+    # Корневой логгер настраивается раньше config: журнал бота не пишется в bot.log и не искажает время
+    logging.basicConfig(level=logging.WARNING)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+class QueryCounter:
+    """Считает SQL-операторы через trace callback sqlite3 на всех соединениях пула."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, statement):
+        # Операторы внутри триггеров приходят с префиксом '--' и отдельно не считаются
+        if not statement.startswith('--'):
+            with self._lock:
+                self.value += 1
+
+    def attach(self, pool):
+        import queue
+
+        pool._writer.set_trace_callback(self)
+        connect = pool._connect
+
+        def traced_connect(readonly=False):
+            conn = connect(readonly)
+            conn.set_trace_callback(self)
+            return conn
+
+        pool._connect = traced_connect
+        readers = []
+        while True:
+            try:
+                readers.append(pool._readers.get_nowait())
+            except queue.Empty:
+                break
+        for conn in readers:
+            conn.set_trace_callback(self)
+            pool._readers.put(conn)
+
+def seed(db, services, clients, rng):
+    from database import parse_duration, normalize_phone
+
+    with db.get_connection() as conn:
+        existing = conn.execute('SELECT COUNT(*) FROM services').fetchone()[0]
+        rows = []
+        for i in range(max(0, services - existing)):
+            duration = rng.choice(DURATIONS)
+            rows.append((CATEGORIES[i % len(CATEGORIES)], f"Услуга {i + 1}", rng.randrange(500, 5000, 100), duration, parse_duration(duration)))
+        conn.executemany('''
+            INSERT INTO services (category, name, price, duration, duration_minutes)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        priced_services = conn.execute('SELECT id, price FROM services').fetchall()
+
+        # В среднем три записи на клиента
+        customers = max(1, clients // 3)
+        phones = [normalize_phone(f"9{rng.randrange(10 ** 9):09d}") for _ in range(customers)]
+        conn.executemany('INSERT INTO customers (telegram_id, first_name, phone) VALUES (?, ?, ?)', (
+            (SEEDED_CUSTOMER_BASE + i, f"{rng.choice(NAMES)}{i}", phone)
+            for i, phone in enumerate(phones)
+        ))
+        now = datetime.now()
+        conn.executemany('INSERT INTO bookings (customer_id, service_id, price, phone, created_at) VALUES (?, ?, ?, ?, ?)', (
+            (
+                SEEDED_CUSTOMER_BASE + customer,
+                *rng.choice(priced_services),
+                phones[customer],
+                (now - timedelta(minutes=rng.randrange(365 * 24 * 60))).strftime('%Y-%m-%d %H:%M:%S'),
+            )
+            for customer in (rng.randrange(customers) for _ in range(clients))
+        ))
+    db.backfill_stats()
+    db.bump_catalog_version()
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+async def run_flow(application, api, counter, index, name, flow, users, concurrency):
+    from telegram import Update
+    from benchmarks.flows import message_update, resolve
+
+    if flow['admin']:
+        user_ids = range(1, users + 1)
+    else:
+        user_ids = range(FLOW_USER_BASE + index * 100_000, FLOW_USER_BASE + index * 100_000 + users)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_user(user_id):
+        async with semaphore:
+            for step in flow['steps']:
+                text = resolve(step, api, user_id)
+                update = Update.de_json(message_update(user_id, text), application.bot)
+                started = time.perf_counter()
+                await application.process_update(update)
+                latencies.append(time.perf_counter() - started)
+
+    api.reset()
+    queries_before = counter.value
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(user_id) for user_id in user_ids))
+    elapsed = time.perf_counter() - started
+    # Уведомления администраторам уходят фоновыми задачами: даём им завершиться в счёт сценария
+    await asyncio.sleep(0.05)
+    queries = counter.value - queries_before
+
+    return {
+        'updates': len(latencies),
+        'seconds': round(elapsed, 4),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 0.90) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3) if latencies else 0.0,
+        'queries_per_update': round(queries / len(latencies), 2) if latencies else 0.0,
+        'api_calls_per_update': round(sum(api.calls.values()) / len(latencies), 2) if latencies else 0.0,
+    }
+
+async def run(args, flows):
+    from database import db
+    from main import build_application
+    from benchmarks.fake_api import FakeBotAPI
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    seed(db, args.services, args.clients, rng)
+    seed_seconds = time.perf_counter() - started
+
+    counter = QueryCounter()
+    counter.attach(db.pool)
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    application = build_application(request=api)
+
+    results = {}
+    async with application:
+        await application.post_init(application)
+        await application.start()
+        try:
+            for index, (name, flow) in enumerate(flows.items()):
+                results[name] = await run_flow(application, api, counter, index, name, flow, args.users, args.concurrency)
+        finally:
+            await application.stop()
+            await application.post_stop(application)
+    await application.post_shutdown(application)
+    return results, seed_seconds
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results):
+    columns = ['updates', 'throughput', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'queries_per_update', 'api_calls_per_update']
+    headers = ['flow', 'updates', 'upd/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'queries/upd', 'api/upd']
+    rows = [[name] + [str(stats[column]) for column in columns] for name, stats in results.items()]
+    widths = [max(len(row[i]) for row in rows + [headers]) for i in range(len(headers))]
+    for row in [headers] + rows:
+        print('  '.join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))))
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='beauty-bench-')
+    configure_environment(args, os.path.join(workdir, 'bench.db'))
+
+    from benchmarks.flows import FLOWS
+
+    unknown = set(args.flows or ()) - set(FLOWS)
+    if unknown:
+        sys.exit(f"Unknown flows: {', '.join(sorted(unknown))}")
+    flows = {name: flow for name, flow in FLOWS.items() if not args.flows or name in args.flows}
+
+    try:
+        results, seed_seconds = asyncio.run(run(args, flows))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'label': args.label,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'services': args.services,
+            'clients': args.clients,
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'api_latency_ms': args.api_latency,
+            'seed_seconds': round(seed_seconds, 2),
+        },
+        'flows': results,
+    }
+    print_table(results)
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{datetime.now():%Y%m%d-%H%M%S}{'-' + args.label if args.label else ''}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nSaved to {path}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
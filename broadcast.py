@@ -0,0 +1,169 @@
+import time
+import asyncio
+import logging
+from datetime import timedelta
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from config import config
+from database import adb
+from tenants import TenantLocal
+from ratelimit import TokenBucket
+
+# Как часто обновлять сообщение о прогрессе у администратора (секунды)
+PROGRESS_INTERVAL = 5
+
+def format_broadcast(message):
+    return f"📢 Сообщение от администратора:\n\n{message}"
+
+def retry_after_seconds(error):
+    delay = error.retry_after
+    return delay.total_seconds() if isinstance(delay, timedelta) else delay
+
+class Broadcaster:
+    """Фоновая рассылка по уникальным telegram_id.
+
+    Каждый получатель получает одно сообщение, поэтому ограничение Telegram
+    на чат выполняется само собой, а общий поток сообщений ограничивает
+    маркерная корзина. Статус доставки пишется в broadcast_recipients после
+    каждой отправки, и незавершённая рассылка продолжается после перезапуска.
+    """
+
+    def __init__(self, database, rate=None, concurrency=None, max_attempts=None):
+        self.database = database
+        self.rate = rate or config.BROADCAST_RATE
+        self.concurrency = concurrency or config.BROADCAST_CONCURRENCY
+        self.max_attempts = max_attempts or config.BROADCAST_MAX_ATTEMPTS
+        self.limiter = TokenBucket(self.rate, burst=self.rate)
+        self._paused_until = 0.0
+        self._tasks = {}
+
+    async def start(self, bot, message, admin_id):
+        broadcast_id = await self.database.create_broadcast(message, admin_id)
+        self._launch(bot, broadcast_id, message, admin_id)
+        return broadcast_id
+
+    async def resume(self, bot):
+        for broadcast_id, message, admin_id in await self.database.get_active_broadcasts():
+            logging.info(f"Resuming broadcast {broadcast_id}")
+            self._launch(bot, broadcast_id, message, admin_id)
+
+    async def stop(self):
+        # Неотправленные получатели остаются в статусе pending до следующего запуска
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _launch(self, bot, broadcast_id, message, admin_id):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(bot, broadcast_id, message, admin_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _run(self, bot, broadcast_id, message, admin_id):
+        recipients = await self.database.get_pending_recipients(broadcast_id)
+        queue = asyncio.Queue()
+        for telegram_id in recipients:
+            queue.put_nowait(telegram_id)
+
+        progress = await self._send_progress(bot, admin_id, broadcast_id, None)
+        workers = [
+            asyncio.create_task(self._worker(bot, broadcast_id, format_broadcast(message), queue))
+            for _ in range(self.concurrency)
+        ]
+        try:
+            while not all(worker.done() for worker in workers):
+                await asyncio.wait(workers, timeout=PROGRESS_INTERVAL)
+                progress = await self._send_progress(bot, admin_id, broadcast_id, progress)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        # Получатели, чей статус не записался, остаются pending: рассылка не завершается,
+        # и resume() продолжит её при следующем запуске
+        unrecorded = sum(worker.result() for worker in workers)
+        if unrecorded:
+            logging.error(f"Broadcast {broadcast_id} left {unrecorded} recipients pending, it will resume after restart")
+            return
+
+        await self.database.finish_broadcast(broadcast_id)
+        stats = await self.database.get_broadcast_stats(broadcast_id)
+        if admin_id:
+            try:
+                await bot.send_message(
+                    admin_id,
+                    f"✅ Рассылка №{broadcast_id} завершена!\n"
+                    f"Успешно отправлено: {stats.get('sent', 0)}\n"
+                    f"Не удалось отправить: {stats.get('failed', 0)}"
+                )
+            except TelegramError as e:
+                logging.error(f"Error reporting broadcast {broadcast_id} to admin {admin_id}: {e}")
+
+    async def _worker(self, bot, broadcast_id, text, queue):
+        """Отправляет получателям из очереди; возвращает число получателей, чей статус не записан."""
+        unrecorded = 0
+        while True:
+            try:
+                telegram_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return unrecorded
+            try:
+                status, attempts, error = await self._deliver(bot, telegram_id, text)
+                await self.database.set_recipient_status(broadcast_id, telegram_id, status, attempts, error)
+            except Exception as e:
+                # Например, database is locked: ошибка одного получателя не останавливает отправителя
+                logging.error(f"Error broadcasting {broadcast_id} to client {telegram_id}: {e}")
+                unrecorded += 1
+
+    async def _wait_for_slot(self):
+        # RetryAfter от Telegram приостанавливает всех отправителей, а не одного
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        await self.limiter.acquire()
+
+    async def _deliver(self, bot, telegram_id, text):
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            await self._wait_for_slot()
+            try:
+                await bot.send_message(telegram_id, text)
+                return 'sent', attempt, None
+            except RetryAfter as e:
+                error = str(e)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after_seconds(e))
+            except (Forbidden, BadRequest) as e:
+                # Пользователь заблокировал бота или чат не существует: повтор не поможет
+                logging.info(f"Broadcast to {telegram_id} rejected: {e}")
+                return 'failed', attempt, str(e)
+            except NetworkError as e:
+                error = str(e)
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramError as e:
+                logging.error(f"Error sending broadcast to client {telegram_id}: {e}")
+                return 'failed', attempt, str(e)
+
+        logging.error(f"Giving up broadcast to client {telegram_id}: {error}")
+        return 'failed', self.max_attempts, error
+
+    async def _send_progress(self, bot, admin_id, broadcast_id, progress):
+        if not admin_id:
+            return None
+
+        stats = await self.database.get_broadcast_stats(broadcast_id)
+        total = sum(stats.values())
+        done = stats.get('sent', 0) + stats.get('failed', 0)
+        text = (
+            f"📢 Рассылка №{broadcast_id}: {done} из {total}\n"
+            f"Отправлено: {stats.get('sent', 0)}, ошибок: {stats.get('failed', 0)}"
+        )
+        try:
+            if progress is None:
+                return await bot.send_message(admin_id, text)
+            if progress.text != text:
+                return await progress.edit_text(text)
+        except TelegramError as e:
+            logging.error(f"Error updating broadcast {broadcast_id} progress: {e}")
+        return progress
+
+broadcaster = TenantLocal(lambda tenant: Broadcaster(adb))
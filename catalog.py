@@ -0,0 +1,51 @@
+import asyncio
+from database import adb
+from tenants import TenantLocal
+
+def service_label(name, price):
+    return f"{name} - {price} руб."
+
+class CatalogSnapshot:
+    """Неизменяемый срез активных услуг для одной версии каталога."""
+
+    def __init__(self, version, services):
+        self.version = version
+        self.services = {}
+        self.by_category = {}
+        self.by_label = {}
+        self.keyboards = {}
+        
+        # Строки get_all_services: (id, category, name, price, duration, is_active)
+        for service in services:
+            self.services[service[0]] = service
+            self.by_category.setdefault(service[1], []).append(service)
+            self.by_label.setdefault(service_label(service[2], service[3]), service[0])
+        
+        for category, items in self.by_category.items():
+            self.keyboards[category] = [[service_label(s[2], s[3])] for s in items] + [['Назад']]
+    
+    def find_by_label(self, text):
+        service_id = self.by_label.get(text)
+        return self.services[service_id] if service_id is not None else None
+
+class Catalog:
+    """Кэш каталога услуг, который перестраивается только при смене версии в Database."""
+
+    def __init__(self, database):
+        self.database = database
+        self._snapshot = None
+        self._lock = asyncio.Lock()
+    
+    def _is_stale(self):
+        return self._snapshot is None or self._snapshot.version != self.database.catalog_version
+    
+    async def get(self):
+        if self._is_stale():
+            async with self._lock:
+                if self._is_stale():
+                    version = self.database.catalog_version
+                    services = await self.database.get_all_services()
+                    self._snapshot = CatalogSnapshot(version, services)
+        return self._snapshot
+
+catalog = TenantLocal(lambda tenant: Catalog(adb))
@@ -2,10 +2,22 @@ from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, filters
 import logging
 from config import config
-from database import db
+from database import adb, settings
+from catalog import catalog
+from menu import menu, BACK
+from notifications import notifier
+from scheduling import availability
+from scheduler import schedule_reminders
 
 # Состояния для ConversationHandler
-PHONE, SERVICE_SELECTION = range(2)
+PHONE, SERVICE_SELECTION, SLOT = range(3)
+
+# Данные незавершённой записи в user_data
+BOOKING_KEYS = ('selected_service', 'phone_number', 'slot_options')
+
+# Неизменные клавиатуры создаются один раз
+ADMIN_KEYBOARD = ReplyKeyboardMarkup([['/admin']], resize_keyboard=True)
+START_KEYBOARD = ReplyKeyboardMarkup([['/start']], resize_keyboard=True)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Очищаем user_data при каждом старте
@@ -13,165 +25,195 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if update.message.from_user.id in config.ADMIN_IDS:
         # Администраторы видят админ-меню
-        keyboard = [['/admin']]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         await update.message.reply_text(
             "Добро пожаловать в панель администратора!",
-            reply_markup=reply_markup
+            reply_markup=ADMIN_KEYBOARD
         )
         return ConversationHandler.END
     
     # Клиентское меню
-    welcome_message = db.get_setting('welcome_message') or 'Рады Вас видеть в нашей студии маникюра "Ноготочки-Точка"!'
-    
-    keyboard = [
-        ['Маникюр', 'Педикюр', 'Наращивание'],
-        ['Перейти в телеграм-канал', 'Перейти на сайт', 'Адрес студии']
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    welcome_message = settings.get('welcome_message') or 'Рады Вас видеть в нашей студии маникюра "Ноготочки-Точка"!'
     
-    await update.message.reply_text(welcome_message, reply_markup=reply_markup)
+    client_menu = await menu.get()
+    await update.message.reply_text(welcome_message, reply_markup=client_menu.main_keyboard)
     return ConversationHandler.END
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Если пользователь администратор и не в админ-панели, предлагаем перейти в админку
     if update.message.from_user.id in config.ADMIN_IDS and not context.user_data.get('in_admin'):
-        keyboard = [['/admin']]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         await update.message.reply_text(
             "Вы администратор. Используйте /admin для доступа к панели управления.",
-            reply_markup=reply_markup
+            reply_markup=ADMIN_KEYBOARD
         )
         return ConversationHandler.END
     
-    text = update.message.text
-    
-    if text == 'Маникюр':
-        services = db.get_services_by_category('Маникюр')
-        if not services:
-            await update.message.reply_text("В настоящее время услуги маникюра недоступны.")
-            return
-            
-        keyboard = []
-        for service in services:
-            keyboard.append([f"{service[1]} - {service[2]} руб."])
-        keyboard.append(['Назад'])
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text("Выберите тип маникюра:", reply_markup=reply_markup)
-    
-    elif text == 'Педикюр':
-        services = db.get_services_by_category('Педикюр')
-        if not services:
-            await update.message.reply_text("В настоящее время услуги педикюра недоступны.")
-            return
-            
-        keyboard = []
-        for service in services:
-            keyboard.append([f"{service[1]} - {service[2]} руб."])
-        keyboard.append(['Назад'])
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text("Выберите тип педикюра:", reply_markup=reply_markup)
-    
-    elif text == 'Наращивание':
-        services = db.get_services_by_category('Наращивание')
-        if not services:
-            await update.message.reply_text("В настоящее время услуги наращивания недоступны.")
-            return
-            
-        keyboard = []
-        for service in services:
-            keyboard.append([f"{service[1]} - {service[2]} руб."])
-        keyboard.append(['Назад'])
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text("Выберите тип наращивания:", reply_markup=reply_markup)
-    
-    elif text == 'Перейти в телеграм-канал':
-        channel_url = db.get_setting('telegram_channel') or config.TELEGRAM_CHANNEL
-        await update.message.reply_text(f"Наш телеграм-канал: {channel_url}")
-    
-    elif text == 'Перейти на сайт':
-        website_url = db.get_setting('website_url') or config.WEBSITE_URL
-        await update.message.reply_text(f"Наш сайт: {website_url}")
-    
-    elif text == 'Адрес студии':
-        lat = float(db.get_setting('location_lat') or config.LOCATION_LAT)
-        lon = float(db.get_setting('location_lon') or config.LOCATION_LON)
-        await update.message.reply_location(latitude=lat, longitude=lon)
-        await update.message.reply_text("Наш адрес на карте:")
-    
-    elif text == 'Назад':
-        keyboard = [
-            ['Маникюр', 'Педикюр', 'Наращивание'],
-            ['Перейти в телеграм-канал', 'Перейти на сайт', 'Адрес студии']
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text("Главное меню:", reply_markup=reply_markup)
-    
-    else:
-        # Проверяем, является ли сообщение выбором услуги
-        services = db.get_all_services()
-        for service in services:
-            service_text = f"{service[2]} - {service[3]} руб."
-            if text == service_text:
-                context.user_data['selected_service'] = service[0]
-                await update.message.reply_text(
-                    f"Вы выбрали: {service[2]}\n"
-                    f"Цена: {service[3]} руб.\n"
-                    f"Время: {service[4]}\n\n"
-                    "Пожалуйста, введите ваш номер телефона для записи:",
-                    reply_markup=ReplyKeyboardRemove()
-                )
-                return PHONE
-
+    found, result = await menu.dispatch(update, context)
+    if not found:
         await update.message.reply_text("Пожалуйста, выберите услугу из меню.")
+    return result
+
+async def restart_from_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Состояние диалога осталось без выбранной услуги (например, user_data очищен):
+    # сбрасываем запись и обрабатываем сообщение как нажатие кнопки меню
+    for key in BOOKING_KEYS:
+        context.user_data.pop(key, None)
+    result = await handle_message(update, context)
+    # None оставил бы диалог в текущем состоянии
+    return ConversationHandler.END if result is None else result
+
+# Действия меню: (update, context, menu, аргумент маршрута)
+async def show_category(update, context, client_menu, category):
+    await update.message.reply_text(
+        f"Выберите услугу в категории «{category}»:",
+        reply_markup=client_menu.category_keyboards[category]
+    )
+
+async def select_service(update, context, client_menu, service):
+    context.user_data['selected_service'] = service[0]
+    await update.message.reply_text(
+        f"Вы выбрали: {service[2]}\n"
+        f"Цена: {service[3]} руб.\n"
+        f"Время: {service[4]}\n\n"
+        "Пожалуйста, введите ваш номер телефона для записи:",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    return PHONE
+
+async def show_channel(update, context, client_menu, argument):
+    channel_url = settings.get('telegram_channel') or config.TELEGRAM_CHANNEL
+    await update.message.reply_text(f"Наш телеграм-канал: {channel_url}")
+
+async def show_website(update, context, client_menu, argument):
+    website_url = settings.get('website_url') or config.WEBSITE_URL
+    await update.message.reply_text(f"Наш сайт: {website_url}")
+
+async def show_location(update, context, client_menu, argument):
+    lat, lon = settings.location(config.LOCATION_LAT, config.LOCATION_LON)
+    await update.message.reply_location(latitude=lat, longitude=lon)
+    await update.message.reply_text("Наш адрес на карте:")
+
+async def show_main_menu(update, context, client_menu, argument):
+    await update.message.reply_text("Главное меню:", reply_markup=client_menu.main_keyboard)
+
+menu.on_category(show_category)
+menu.on_service(select_service)
+menu.register('Перейти в телеграм-канал', show_channel, main=True)
+menu.register('Перейти на сайт', show_website, main=True)
+menu.register('Адрес студии', show_location, main=True)
+menu.register(BACK, show_main_menu)
+
+NO_SLOT = 'Без выбора времени'
+
+async def get_service(service_id):
+    snapshot = await catalog.get()
+    return snapshot.services.get(service_id) or await adb.get_service_by_id(service_id)
+
+async def offer_slots(update, context, service):
+    # Строки services: (..., duration, is_active, duration_minutes)
+    duration = service[6] or config.DEFAULT_SERVICE_DURATION
+    slots = await availability.next_slots(duration)
+    if not slots:
+        return False
+    
+    # В user_data только простые значения: они сохраняются между перезапусками
+    options = {availability.label(slot): (slot.master_id, slot.starts_at, slot.ends_at) for slot in slots}
+    context.user_data['slot_options'] = options
+    keyboard = [list(options)[i:i + 2] for i in range(0, len(options), 2)] + [[NO_SLOT]]
+    await update.message.reply_text(
+        "Выберите удобное время:",
+        reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    )
+    return True
 
 async def get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     phone_number = update.message.text
     service_id = context.user_data.get('selected_service')
+    if not service_id:
+        return await restart_from_menu(update, context)
+    
+    service = await get_service(service_id)
+    context.user_data['phone_number'] = phone_number
+    try:
+        if await offer_slots(update, context, service):
+            return SLOT
+    except Exception as e:
+        logging.error(f"Error searching free slots for service {service_id}: {e}")
+    
+    # Свободного времени нет: записываем как раньше, время согласует администратор
+    client_id = await adb.add_client(
+        update.message.from_user.id,
+        update.message.from_user.first_name,
+        phone_number,
+        service_id
+    )
+    await finish_booking(update, context, service, client_id)
     
-    if service_id:
-        service = db.get_service_by_id(service_id)
-        client_id = db.add_client(
-            update.message.from_user.id,
-            update.message.from_user.first_name,
-            phone_number,
-            service_id
-        )
-        
-        # Отправляем уведомление администраторам
-        from main import application
-        for admin_id in config.ADMIN_IDS:
+    # Очищаем временные данные
+    for key in BOOKING_KEYS:
+        context.user_data.pop(key, None)
+    return ConversationHandler.END
+
+async def slot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    service_id = context.user_data.get('selected_service')
+    phone_number = context.user_data.get('phone_number')
+    options = context.user_data.get('slot_options', {})
+    
+    if not service_id:
+        return await restart_from_menu(update, context)
+    if text != NO_SLOT and text not in options:
+        await update.message.reply_text("Пожалуйста, выберите время кнопкой меню.")
+        return SLOT
+    
+    service = await get_service(service_id)
+    user = update.message.from_user
+    slot = None
+    if text == NO_SLOT:
+        client_id = await adb.add_client(user.id, user.first_name, phone_number, service_id)
+    else:
+        master_id, starts_at, ends_at = options[text]
+        client_id = await availability.book(user.id, user.first_name, phone_number, service_id, master_id, starts_at, ends_at)
+        if client_id is None:
+            await update.message.reply_text("К сожалению, это время только что заняли.")
+            if await offer_slots(update, context, service):
+                return SLOT
+            client_id = await adb.add_client(user.id, user.first_name, phone_number, service_id)
+        else:
+            slot = text
             try:
-                await application.bot.send_message(
-                    admin_id,
-                    f"🎉 Новая запись!\n"
-                    f"Клиент № {client_id}: {update.message.from_user.first_name}\n"
-                    f"Телефон: {phone_number}\n"
-                    f"Услуга: {service[2]} ({service[1]})\n"
-                    f"Стоимость: {service[3]} руб.\n"
-                    f"Время: {service[4]}\n\n"
-                    "📞 Свяжитесь с клиентом для согласования времени!"
-                )
+                await schedule_reminders(client_id, user.id, service[2], starts_at)
             except Exception as e:
-                logging.error(f"Error sending message to admin {admin_id}: {e}")
-        
-        keyboard = [['/start']]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text(
-            "✅ Спасибо за запись! Администратор свяжется с вами в ближайшее время для подтверждения времени.",
-            reply_markup=reply_markup
-        )
+                logging.error(f"Error scheduling reminders for booking {client_id}: {e}")
     
-    # Очищаем временные данные
-    context.user_data.pop('selected_service', None)
+    await finish_booking(update, context, service, client_id, slot)
+    for key in BOOKING_KEYS:
+        context.user_data.pop(key, None)
     return ConversationHandler.END
 
+async def finish_booking(update, context, service, client_id, slot=None):
+    if slot:
+        confirmation = f"✅ Спасибо за запись! Ждём вас: {slot}."
+    else:
+        confirmation = "✅ Спасибо за запись! Администратор свяжется с вами в ближайшее время для подтверждения времени."
+    await update.message.reply_text(confirmation, reply_markup=START_KEYBOARD)
+    
+    # Уведомление администраторам отправляется в фоне, клиент его не ждёт
+    notifier.notify(
+        f"🎉 Новая запись!\n"
+        f"Клиент № {client_id}: {update.message.from_user.first_name}\n"
+        f"Телефон: {context.user_data.get('phone_number')}\n"
+        f"Услуга: {service[2]} ({service[1]})\n"
+        f"Стоимость: {service[3]} руб.\n"
+        f"Время: {service[4]}\n"
+        + (f"Записан на: {slot}" if slot else "\n📞 Свяжитесь с клиентом для согласования времени!")
+    )
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Очищаем временные данные
     context.user_data.clear()
     
     await update.message.reply_text(
         "❌ Действие отменено.",
-        reply_markup=ReplyKeyboardMarkup([['/start']], resize_keyboard=True)
+        reply_markup=START_KEYBOARD
     )
     return ConversationHandler.END
\ No newline at end of file
@@ -1,6 +1,9 @@
 import os
+import json
 from dotenv import load_dotenv
 import logging
+from logs import setup_logging
+from tenants import Tenant, TenantLocal
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -17,9 +20,87 @@ class Config:
     LOCATION_LAT = float(os.getenv('LOCATION_LAT', 0))
     LOCATION_LON = float(os.getenv('LOCATION_LON', 0))
     
+    # Получение обновлений: polling (по умолчанию) или webhook
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+    HEALTH_PATH = os.getenv('HEALTH_PATH', '/healthz')
+    
+    # Сколько обновлений из разных чатов обрабатывать одновременно
+    MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', 32))
+    
+    # Ограничение частоты для клиентов: сообщений в секунду, подряд и окно повторных нажатий, с
+    USER_RATE = float(os.getenv('USER_RATE', 1))
+    USER_BURST = int(os.getenv('USER_BURST', 5))
+    DUPLICATE_WINDOW = float(os.getenv('DUPLICATE_WINDOW', 1))
+    
+    # Сохранение user_data и состояний диалогов между перезапусками
+    PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', 30))
+    PERSISTENCE_TTL = int(os.getenv('PERSISTENCE_TTL', 7 * 24 * 3600))
+    
+    # PDF-отчёты: число процессов для отрисовки и размер кэша готовых файлов
+    REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', 2))
+    REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', 16))
+    
+    # Запись на время: шаг сетки и число предлагаемых слотов, минуты и дни
+    SLOT_STEP = int(os.getenv('SLOT_STEP', 30))
+    SLOT_OPTIONS = int(os.getenv('SLOT_OPTIONS', 6))
+    SLOT_LEAD_TIME = int(os.getenv('SLOT_LEAD_TIME', 60))
+    SLOT_SEARCH_DAYS = int(os.getenv('SLOT_SEARCH_DAYS', 30))
+    DEFAULT_SERVICE_DURATION = int(os.getenv('DEFAULT_SERVICE_DURATION', 60))
+    
+    # Планировщик задач: напоминания (часы до визита), ночное обслуживание
+    SCHEDULER_CONCURRENCY = int(os.getenv('SCHEDULER_CONCURRENCY', 4))
+    SCHEDULER_BATCH = int(os.getenv('SCHEDULER_BATCH', 50))
+    REMINDER_HOURS = [float(h) for h in os.getenv('REMINDER_HOURS', '24,2').split(',') if h.strip()]
+    MAINTENANCE_HOUR = int(os.getenv('MAINTENANCE_HOUR', 3))
+    JOBS_RETENTION_DAYS = int(os.getenv('JOBS_RETENTION_DAYS', 30))
+    
+    # Метрики в формате Prometheus на локальном порту; 0 — не открывать порт
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 9180))
+    METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+    LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.5))
+    
+    # Логирование: text или json; ротация по размеру или по времени (LOG_ROTATE_WHEN=midnight)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    LOG_CONSOLE = os.getenv('LOG_CONSOLE', '1') == '1'
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 10))
+    LOG_COMPRESS = os.getenv('LOG_COMPRESS', '1') == '1'
+    
     # База данных
+    DATABASE_PATH = os.getenv('DATABASE_PATH', 'beauty_bot.db')
+    DATABASE_READERS = int(os.getenv('DATABASE_READERS', 4))
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///beauty_salon.db')
     
+    # Групповая запись клиентов: ожидание пачки в миллисекундах и её наибольший размер
+    BOOKING_BATCH_DELAY = float(os.getenv('BOOKING_BATCH_DELAY', 5))
+    BOOKING_BATCH_SIZE = int(os.getenv('BOOKING_BATCH_SIZE', 200))
+    
+    # Рассылки: общий лимит Telegram около 30 сообщений в секунду
+    BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 25))
+    BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 8))
+    BROADCAST_MAX_ATTEMPTS = int(os.getenv('BROADCAST_MAX_ATTEMPTS', 5))
+    
+    # Уведомления администраторам о новых записях
+    NOTIFY_TIMEOUT = float(os.getenv('NOTIFY_TIMEOUT', 10))
+    NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', 3))
+    # Окно сводки в секундах; 0 — отправлять каждую запись сразу
+    NOTIFY_DIGEST_WINDOW = float(os.getenv('NOTIFY_DIGEST_WINDOW', 0))
+    
+    # Несколько салонов в одном процессе: JSON-файл со списком салонов (см. README)
+    TENANTS_FILE = os.getenv('TENANTS_FILE', '')
+    TENANTS_DIR = os.getenv('TENANTS_DIR', 'tenants')
+    # Общий пул потоков базы для всех салонов
+    TENANT_DB_WORKERS = int(os.getenv('TENANT_DB_WORKERS', 16))
+    
     # Проверка загрузки переменных
     def check_config(self):
         config_status = {}
@@ -35,18 +116,72 @@ class Config:
         
         return config_status
 
-# Создаем экземпляр конфигурации
-config = Config()
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
+# Настройки процесса, которые не задаются для отдельного салона
+PROCESS_SETTINGS = ('LOG_', 'METRICS_', 'TENANT', 'LOOP_LAG_', 'REPORT_WORKERS', 'BOT_MODE', 'WEBHOOK_', 'HEALTH_')
+
+def coerce_setting(key, value):
+    """Приводит значение из файла салонов к типу настройки в Config, как при чтении из окружения."""
+    default = getattr(Config, key)
+    try:
+        if isinstance(default, list):
+            # Список задаётся строкой через запятую, как в окружении, или списком JSON
+            items = value.split(',') if isinstance(value, str) else value
+            if not isinstance(items, list):
+                raise ValueError
+            item_type = float if key == 'REMINDER_HOURS' else int
+            return [item_type(str(item).strip()) for item in items if str(item).strip()]
+        if isinstance(default, bool):
+            return value if isinstance(value, bool) else str(value) == '1'
+        if isinstance(default, (int, float)):
+            # Через str: True и 1.5 не превращаются молча в 1
+            return type(default)(str(value).strip())
+        if isinstance(value, (list, dict, bool)):
+            raise ValueError
+        return str(value)
+    except ValueError:
+        expected = 'list' if isinstance(default, list) else type(default).__name__
+        raise ValueError(f"Setting {key!r} must be {expected}, got {value!r}") from None
+
+def tenant_config(overrides):
+    """Config салона: значения из файла салонов поверх общих настроек из окружения."""
+    tenant = Config()
+    for key, value in overrides.items():
+        if not key.isupper() or not hasattr(Config, key):
+            raise ValueError(f"Unknown setting {key!r}")
+        if key.startswith(PROCESS_SETTINGS):
+            raise ValueError(f"Setting {key!r} applies to the whole process and cannot be set per tenant")
+        setattr(tenant, key, coerce_setting(key, value))
+    return tenant
+
+def load_tenants(path):
+    """Читает список салонов: [{"name": ..., "BOT_TOKEN": ..., другие настройки}, ...]."""
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    
+    tenants = []
+    for entry in entries:
+        entry = dict(entry)
+        name = entry.pop('name', None)
+        if not name or any(tenant.name == name for tenant in tenants):
+            raise ValueError(f"Tenant name is missing or duplicated: {name!r}")
+        if not entry.get('BOT_TOKEN'):
+            raise ValueError(f"Tenant {name!r} has no BOT_TOKEN")
+        # По умолчанию у каждого салона свой файл базы
+        entry.setdefault('DATABASE_PATH', os.path.join(Config.TENANTS_DIR, f"{name}.db"))
+        try:
+            tenants.append(Tenant(name, tenant_config(entry)))
+        except ValueError as e:
+            raise ValueError(f"Tenant {name!r}: {e}") from None
+    
+    for tenant in tenants:
+        os.makedirs(os.path.dirname(tenant.config.DATABASE_PATH) or '.', exist_ok=True)
+    return tenants
+
+# Создаем экземпляр конфигурации; в многопользовательском режиме у каждого салона свой
+config = TenantLocal(lambda tenant: tenant.config if tenant else Config())
+
+# Настройка логирования: запись в файл идёт в отдельном потоке (logs.py)
+setup_logging(config)
 
 logger = logging.getLogger(__name__)
 
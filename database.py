@@ -1,93 +1,651 @@
+import re
+import time
+import queue
+import asyncio
 import sqlite3
 import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from config import config
+from metrics import metrics
+from tenants import TenantLocal
+
+# Прагмы, которые выставляются один раз при открытии соединения
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+)
+
+# Миграции схемы. Каждая выполняется один раз в отдельной транзакции,
+# номер применённой миграции записывается в таблицу schema_version.
+# Миграция, которая возвращает True, повторяется следующей транзакцией:
+# так большие таблицы переносятся пачками, и прерванный перенос продолжается с места остановки.
+# Миграции выполняются при запуске, до обработки обновлений: бот ждёт их окончания.
+def migrate_initial_schema(cursor):
+    # Таблица услуг
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS services (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            name TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            duration TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+    ''')
+    
+    # Таблица клиентов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER NOT NULL,
+            first_name TEXT NOT NULL,
+            phone_number TEXT NOT NULL,
+            service_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (service_id) REFERENCES services (id)
+        )
+    ''')
+    
+    # Таблица настроек
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT UNIQUE NOT NULL,
+            value TEXT NOT NULL
+        )
+    ''')
+    
+    # Добавляем начальные услуги
+    initial_services = [
+        ('Маникюр', 'Классический', 1500, '3 часа'),
+        ('Маникюр', 'Гель-лак', 2500, '5 часов'),
+        ('Маникюр', 'Аппаратный', 3500, '2 часа'),
+        ('Педикюр', 'Аппаратный', 1000, '30 минут'),
+        ('Наращивание', 'Верхние формы', 3000, '2 часа'),
+        ('Наращивание', 'Типсы', 1500, '1.5 часа')
+    ]
+    
+    # Базы, созданные до миграций, уже содержат услуги: повторно их не добавляем
+    cursor.execute('SELECT COUNT(*) FROM services')
+    if cursor.fetchone()[0] == 0:
+        cursor.executemany('''
+            INSERT INTO services (category, name, price, duration)
+            VALUES (?, ?, ?, ?)
+        ''', initial_services)
+    
+    # Добавляем начальные настройки
+    initial_settings = [
+        ('welcome_message', 'Рады Вас видеть в нашей студии маникюра "Ноготочки-Точка"!'),
+        ('telegram_channel', 'https://t.me/your_channel'),
+        ('website_url', 'https://your-website.com'),
+        ('phone_number', '+79991234567'),
+        ('location_lat', '55.7558'),
+        ('location_lon', '37.6173')
+    ]
+    
+    for key, value in initial_settings:
+        cursor.execute('''
+            INSERT OR IGNORE INTO settings (key, value)
+            VALUES (?, ?)
+        ''', (key, value))
+
+def migrate_indexes(cursor):
+    # Диапазонные выборки клиентов по дате и поиск по telegram_id
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_clients_created_at ON clients (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_clients_telegram_id ON clients (telegram_id)')
+    
+    # Покрывающий индекс для выборки услуг категории без обращения к таблице
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_services_category_active
+        ON services (category, is_active, name, price, duration)
+    ''')
+    cursor.execute('ANALYZE')
+
+def migrate_broadcasts(cursor):
+    # Рассылки и статус доставки по каждому получателю, чтобы продолжить после перезапуска
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT NOT NULL,
+            admin_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'running',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL,
+            telegram_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (broadcast_id, telegram_id),
+            FOREIGN KEY (broadcast_id) REFERENCES broadcasts (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status
+        ON broadcast_recipients (broadcast_id, status)
+    ''')
+
+def migrate_persistence(cursor):
+    # user_data, chat_data и состояния диалогов; kind: user, chat или conversation:<имя>
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persistence_data (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data BLOB NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_persistence_data_updated_at
+        ON persistence_data (updated_at)
+    ''')
+
+def backfill_booking_stats(cursor):
+    # День и выручка считаются так же, как в Database._insert_booking: местная дата и цена из записи
+    cursor.execute('DELETE FROM booking_stats_daily')
+    cursor.execute('''
+        INSERT INTO booking_stats_daily (day, service_id, bookings, revenue)
+        SELECT date(created_at, 'localtime'), COALESCE(service_id, 0), COUNT(*), COALESCE(SUM(price), 0)
+        FROM bookings
+        GROUP BY 1, 2
+    ''')
+    return cursor.rowcount
+
+def migrate_booking_stats(cursor):
+    # Число записей и выручка по местным дням и услугам; таблицу заполняет миграция 11
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS booking_stats_daily (
+            day TEXT NOT NULL,
+            service_id INTEGER NOT NULL,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, service_id)
+        ) WITHOUT ROWID
+    ''')
+
+# Столбцы clients в прежнем порядке: обработчики читают строки по индексам, а цена записи
+# нужна только выгрузке
+CLIENT_COLUMNS = 'c.id, c.telegram_id, c.first_name, c.phone_number, c.service_id, c.created_at'
+
+# Символы, которые убираются из номера телефона перед индексацией
+PHONE_SEPARATORS = '+ -().'
+
+def phone_digits_sql(column):
+    expression = column
+    for char in PHONE_SEPARATORS:
+        expression = f"replace({expression}, '{char}', '')"
+    return expression
+
+def migrate_clients_search(cursor):
+    # Триграммный индекс ищет по любой подстроке имени или цифр телефона, включая префиксы
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS clients_fts
+        USING fts5(first_name, phone, tokenize = 'trigram')
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS clients_fts_insert AFTER INSERT ON clients BEGIN
+            INSERT INTO clients_fts (rowid, first_name, phone)
+            VALUES (new.id, new.first_name, {phone_digits_sql('new.phone_number')});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS clients_fts_delete AFTER DELETE ON clients BEGIN
+            DELETE FROM clients_fts WHERE rowid = old.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS clients_fts_update AFTER UPDATE OF first_name, phone_number ON clients BEGIN
+            UPDATE clients_fts
+            SET first_name = new.first_name, phone = {phone_digits_sql('new.phone_number')}
+            WHERE rowid = new.id;
+        END
+    ''')
+    cursor.execute('DELETE FROM clients_fts')
+    cursor.execute(f'''
+        INSERT INTO clients_fts (rowid, first_name, phone)
+        SELECT id, first_name, {phone_digits_sql('phone_number')} FROM clients
+    ''')
+
+# Число строк clients, переносимых в customers/bookings за одну транзакцию
+MIGRATION_BATCH_SIZE = 5000
+
+def normalize_phone(raw):
+    """Приводит номер к E.164; российские 8XXXXXXXXXX и 9XXXXXXXXX дополняются кодом +7.
+    
+    Если цифр не от 10 до 15, это не номер телефона: возвращается исходная
+    строка без пробелов по краям, чтобы не потерять ввод клиента.
+    """
+    if raw is None:
+        return None
+    digits = ''.join(char for char in raw if char.isdigit())
+    if len(digits) == 11 and digits[0] == '8':
+        digits = '7' + digits[1:]
+    elif len(digits) == 10 and digits[0] == '9':
+        digits = '7' + digits
+    return f'+{digits}' if 10 <= len(digits) <= 15 else raw.strip()
+
+def migrate_customers(cursor):
+    # Один клиент — одна строка; telegram_id служит rowid, поэтому выборка всех клиентов не требует DISTINCT
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS customers (
+            telegram_id INTEGER PRIMARY KEY,
+            first_name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER NOT NULL,
+            service_id INTEGER,
+            phone TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (customer_id) REFERENCES customers (telegram_id),
+            FOREIGN KEY (service_id) REFERENCES services (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_created_at ON bookings (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_customer ON bookings (customer_id)')
+    
+    # Перенос идёт пачками: каждая пачка — короткая транзакция, после сбоя продолжается с места остановки
+    return copy_clients_batch(cursor, MIGRATION_BATCH_SIZE)
+
+def copy_clients_batch(cursor, limit=None):
+    """Переносит следующие строки clients в customers/bookings. Возвращает True, если остались ещё."""
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM bookings')
+    last_id = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT MAX(id), COUNT(*) FROM (SELECT id FROM clients WHERE id > ? ORDER BY id LIMIT ?)
+    ''', (last_id, limit or -1))
+    upper_id, count = cursor.fetchone()
+    if not count:
+        return False
+    
+    # Строки идут по возрастанию id, поэтому у клиента остаются имя и телефон из последней записи
+    cursor.execute('''
+        INSERT INTO customers (telegram_id, first_name, phone, created_at, updated_at)
+        SELECT telegram_id, first_name, normalize_phone(phone_number), created_at, created_at
+        FROM clients
+        WHERE id > ? AND id <= ?
+        ORDER BY id
+        ON CONFLICT (telegram_id) DO UPDATE SET
+            first_name = excluded.first_name,
+            phone = excluded.phone,
+            updated_at = excluded.updated_at
+    ''', (last_id, upper_id))
+    # Телефон остаётся в каждой записи таким, каким его ввели для неё
+    cursor.execute('''
+        INSERT INTO bookings (id, customer_id, service_id, phone, created_at)
+        SELECT id, telegram_id, service_id, normalize_phone(phone_number), created_at
+        FROM clients
+        WHERE id > ? AND id <= ?
+    ''', (last_id, upper_id))
+    return limit is not None and count == limit
+
+def migrate_clients_view(cursor):
+    # Дописываем строки, появившиеся после переноса, и сверяем количество
+    copy_clients_batch(cursor)
+    cursor.execute('SELECT (SELECT COUNT(*) FROM clients), (SELECT COUNT(*) FROM bookings)')
+    clients_count, bookings_count = cursor.fetchone()
+    if clients_count != bookings_count:
+        raise RuntimeError(f"clients has {clients_count} rows, bookings has {bookings_count}")
+    
+    # Номера новых записей продолжают последовательность clients, даже если последние строки удалялись
+    cursor.execute('''
+        SELECT MAX(seq) FROM sqlite_sequence WHERE name IN ('clients', 'bookings')
+    ''')
+    seq = cursor.fetchone()[0]
+    cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'bookings'")
+    if seq:
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('bookings', ?)", (seq,))
+    
+    # Индексы и триггеры поиска удаляются вместе с таблицей
+    cursor.execute('DROP TABLE clients')
+    cursor.execute('DROP TABLE IF EXISTS clients_fts')
+    
+    # Совместимость: прежние запросы читают clients как раньше, одна строка на запись
+    cursor.execute('''
+        CREATE VIEW clients AS
+        SELECT b.id, b.customer_id AS telegram_id, cu.first_name, b.phone AS phone_number,
+               b.service_id, b.created_at
+        FROM bookings b
+        JOIN customers cu ON cu.telegram_id = b.customer_id
+    ''')
+    
+    # Поисковый индекс теперь растёт по числу клиентов, а не записей
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts
+        USING fts5(first_name, phone, tokenize = 'trigram')
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS customers_fts_insert AFTER INSERT ON customers BEGIN
+            INSERT INTO customers_fts (rowid, first_name, phone)
+            VALUES (new.telegram_id, new.first_name, {phone_digits_sql('new.phone')});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS customers_fts_delete AFTER DELETE ON customers BEGIN
+            DELETE FROM customers_fts WHERE rowid = old.telegram_id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS customers_fts_update AFTER UPDATE OF first_name, phone ON customers BEGIN
+            UPDATE customers_fts
+            SET first_name = new.first_name, phone = {phone_digits_sql('new.phone')}
+            WHERE rowid = new.telegram_id;
+        END
+    ''')
+    cursor.execute(f'''
+        INSERT INTO customers_fts (rowid, first_name, phone)
+        SELECT telegram_id, first_name, {phone_digits_sql('phone')} FROM customers
+    ''')
+    cursor.execute('ANALYZE')
+
+def parse_duration(text):
+    """Переводит длительность вида '1.5 часа', '30 минут', '2 ч 30 мин' в минуты; None, если не разобрать."""
+    total = 0
+    for number, unit in re.findall(r'(\d+(?:[.,]\d+)?)\s*([а-яёa-z]*)', (text or '').lower()):
+        value = float(number.replace(',', '.'))
+        if unit.startswith(('мин', 'm')) or unit == 'м':
+            total += value
+        elif unit.startswith(('ч', 'h')):
+            total += value * 60
+        elif not unit:
+            # Число без единиц: до 12 — часы, больше — минуты
+            total += value * 60 if value <= 12 else value
+        else:
+            return None
+    return round(total) or None
+
+# Рабочие часы мастера по умолчанию: понедельник–суббота с 10:00 до 20:00
+DEFAULT_WORKING_HOURS = [(weekday, 10 * 60, 20 * 60) for weekday in range(6)]
+
+def migrate_schedule(cursor):
+    cursor.execute('ALTER TABLE services ADD COLUMN duration_minutes INTEGER')
+    cursor.execute('SELECT id, duration FROM services')
+    cursor.executemany(
+        'UPDATE services SET duration_minutes = ? WHERE id = ?',
+        [(parse_duration(duration), service_id) for service_id, duration in cursor.fetchall()]
+    )
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS masters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+    ''')
+    # Время хранится в минутах от полуночи, weekday: 0 — понедельник
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS working_hours (
+            master_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            PRIMARY KEY (master_id, weekday, start_minute),
+            FOREIGN KEY (master_id) REFERENCES masters (id)
+        ) WITHOUT ROWID
+    ''')
+    # Локальное время студии в формате 'YYYY-MM-DD HH:MM'
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            booking_id INTEGER NOT NULL,
+            master_id INTEGER NOT NULL,
+            starts_at TEXT NOT NULL,
+            ends_at TEXT NOT NULL,
+            FOREIGN KEY (booking_id) REFERENCES bookings (id),
+            FOREIGN KEY (master_id) REFERENCES masters (id)
+        )
+    ''')
+    # Пересечения ищутся по ends_at > начало слота: индекс отсекает прошедшие записи
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_master_end ON appointments (master_id, ends_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_booking ON appointments (booking_id)')
+    
+    cursor.execute('SELECT COUNT(*) FROM masters')
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("INSERT INTO masters (name) VALUES ('Мастер')")
+        master_id = cursor.lastrowid
+        cursor.executemany(
+            'INSERT INTO working_hours (master_id, weekday, start_minute, end_minute) VALUES (?, ?, ?, ?)',
+            [(master_id, *hours) for hours in DEFAULT_WORKING_HOURS]
+        )
+
+def migrate_jobs(cursor):
+    # Отложенные задачи; run_at — unix-время, payload — JSON, dedupe_key не даёт завести задачу дважды
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            run_at REAL NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            dedupe_key TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (run_at) WHERE status = 'pending'")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs (finished_at)')
+
+def migrate_booking_prices(cursor):
+    # Цена фиксируется в записи, чтобы правка прайса не меняла прошлую выручку
+    cursor.execute('ALTER TABLE bookings ADD COLUMN price INTEGER')
+    # Цена прежних записей не сохранялась: берём текущую цену услуги, это приближение
+    cursor.execute('''
+        UPDATE bookings SET price = (SELECT price FROM services WHERE id = bookings.service_id)
+    ''')
+    # Прежние агрегаты считались по UTC-датам и текущим ценам: пересчитываем
+    backfill_booking_stats(cursor)
+
+def migrate_clients_view_prices(cursor):
+    # Выгрузка берёт цену из записи, как отчёты
+    cursor.execute('DROP VIEW clients')
+    cursor.execute('''
+        CREATE VIEW clients AS
+        SELECT b.id, b.customer_id AS telegram_id, cu.first_name, b.phone AS phone_number,
+               b.service_id, b.created_at, b.price
+        FROM bookings b
+        JOIN customers cu ON cu.telegram_id = b.customer_id
+    ''')
+
+MIGRATIONS = [
+    (1, 'initial schema', migrate_initial_schema),
+    (2, 'clients and services indexes', migrate_indexes),
+    (3, 'broadcast delivery tracking', migrate_broadcasts),
+    (4, 'bot state persistence', migrate_persistence),
+    (5, 'daily booking aggregates', migrate_booking_stats),
+    (6, 'client search index', migrate_clients_search),
+    (7, 'customers and bookings tables', migrate_customers),
+    (8, 'clients compatibility view', migrate_clients_view),
+    (9, 'service durations, masters and appointments', migrate_schedule),
+    (10, 'scheduled jobs', migrate_jobs),
+    (11, 'booking prices and local-day aggregates', migrate_booking_prices),
+    (12, 'clients view with booking prices', migrate_clients_view_prices),
+]
+
+class ConnectionPool:
+    """Пул долгоживущих соединений: один писатель и ограниченный набор читателей.
+    
+    В режиме WAL читатели не ждут писателя, поэтому запросы каталога
+    выполняются параллельно с записью клиентов.
+    """
+    
+    def __init__(self, db_name, readers=4, timeout=5.0):
+        self.db_name = db_name
+        self.timeout = timeout
+        self.size = readers
+        self._writer = self._connect()
+        self._writer_lock = threading.Lock()
+        self._readers = queue.LifoQueue(maxsize=readers)
+        self._created = 0
+        self._created_lock = threading.Lock()
+    
+    def _connect(self, readonly=False):
+        conn = sqlite3.connect(self.db_name, timeout=self.timeout, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        # Функция нужна миграциям и запросам, которые нормализуют телефон в SQL
+        conn.create_function('normalize_phone', 1, normalize_phone, deterministic=True)
+        if readonly:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+    
+    def _acquire_reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        
+        # Новые соединения открываются лениво, но не больше размера пула
+        with self._created_lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect(readonly=True)
+        return self._readers.get()
+    
+    @contextmanager
+    def reader(self):
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+    
+    @contextmanager
+    def writer(self):
+        with self._writer_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer.rollback()
+                raise
+            else:
+                self._writer.commit()
+    
+    def close(self):
+        with self._writer_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+class SettingsCache:
+    """Кэш таблицы settings: значения хранятся и в виде строк, и в разобранном виде."""
+    
+    FLOAT_KEYS = ('location_lat', 'location_lon')
+    
+    def __init__(self):
+        self._values = {}
+        self._typed = {}
+    
+    def _parse(self, key, value):
+        if key in self.FLOAT_KEYS:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+        return value
+    
+    def load(self, rows):
+        values = dict(rows)
+        typed = {key: self._parse(key, value) for key, value in values.items()}
+        # Подменяем словари целиком, чтобы читатели не увидели половину обновления
+        self._values, self._typed = values, typed
+    
+    def set(self, key, value):
+        self._values[key] = value
+        self._typed[key] = self._parse(key, value)
+    
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+    
+    def get_typed(self, key, default=None):
+        value = self._typed.get(key)
+        return default if value is None else value
+    
+    def location(self, default_lat, default_lon):
+        return self.get_typed('location_lat', default_lat), self.get_typed('location_lon', default_lon)
 
 class Database:
-    def __init__(self, db_name='beauty_bot.db'):
+    def __init__(self, db_name='beauty_bot.db', pool_size=4):
         self.db_name = db_name
+        self.pool = ConnectionPool(db_name, readers=pool_size)
+        self.catalog_version = 0
+        self.bookings_version = 0
+        self.settings = SettingsCache()
         self.init_db()
+        self.reload_settings()
     
     def get_connection(self):
-        return sqlite3.connect(self.db_name)
+        # Соединение на запись; фиксация транзакции выполняется при выходе из блока
+        return self.pool.writer()
+    
+    def read_connection(self):
+        return self.pool.reader()
+    
+    def close(self):
+        self.pool.close()
     
     def init_db(self):
         try:
             with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Таблица услуг
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS services (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        category TEXT NOT NULL,
-                        name TEXT NOT NULL,
-                        price INTEGER NOT NULL,
-                        duration TEXT NOT NULL,
-                        is_active BOOLEAN DEFAULT TRUE
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 ''')
+            
+            current_version = self.get_schema_version()
+            for version, description, migrate in MIGRATIONS:
+                if version <= current_version:
+                    continue
                 
-                # Таблица клиентов
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS clients (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        telegram_id INTEGER NOT NULL,
-                        first_name TEXT NOT NULL,
-                        phone_number TEXT NOT NULL,
-                        service_id INTEGER,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (service_id) REFERENCES services (id)
-                    )
-                ''')
-                
-                # Таблица настроек
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS settings (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        key TEXT UNIQUE NOT NULL,
-                        value TEXT NOT NULL
-                    )
-                ''')
-                
-                # Добавляем начальные услуги
-                initial_services = [
-                    ('Маникюр', 'Классический', 1500, '3 часа'),
-                    ('Маникюр', 'Гель-лак', 2500, '5 часов'),
-                    ('Маникюр', 'Аппаратный', 3500, '2 часа'),
-                    ('Педикюр', 'Аппаратный', 1000, '30 минут'),
-                    ('Наращивание', 'Верхние формы', 3000, '2 часа'),
-                    ('Наращивание', 'Типсы', 1500, '1.5 часа')
-                ]
-                
-                for service in initial_services:
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO services (category, name, price, duration)
-                        VALUES (?, ?, ?, ?)
-                    ''', service)
-                
-                # Добавляем начальные настройки
-                initial_settings = [
-                    ('welcome_message', 'Рады Вас видеть в нашей студии маникюра "Ноготочки-Точка"!'),
-                    ('telegram_channel', 'https://t.me/your_channel'),
-                    ('website_url', 'https://your-website.com'),
-                    ('phone_number', '+79991234567'),
-                    ('location_lat', '55.7558'),
-                    ('location_lon', '37.6173')
-                ]
-                
-                for key, value in initial_settings:
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO settings (key, value)
-                        VALUES (?, ?)
-                    ''', (key, value))
-                
-                conn.commit()
+                more = True
+                while more:
+                    with self.get_connection() as conn:
+                        conn.execute('BEGIN')
+                        more = migrate(conn.cursor())
+                        if not more:
+                            conn.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+                logging.info(f"Applied database migration {version}: {description}")
                 
         except Exception as e:
+            # Бот не должен работать со схемой, применённой наполовину
             logging.error(f"Error initializing database: {e}")
+            raise
     
-    def get_services_by_category(self, category):
+    def get_schema_version(self):
         with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MAX(version) FROM schema_version')
+            return cursor.fetchone()[0] or 0
+    
+    def get_services_by_category(self, category):
+        with self.read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT id, name, price, duration FROM services 
@@ -96,72 +654,265 @@ class Database:
             return cursor.fetchall()
     
     def get_service_by_id(self, service_id):
-        with self.get_connection() as conn:
+        with self.read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM services WHERE id = ?', (service_id,))
             return cursor.fetchone()
     
     def add_client(self, telegram_id, first_name, phone_number, service_id):
+        with self.get_connection() as conn:
+            client_id = self._insert_booking(conn.cursor(), telegram_id, first_name, phone_number, service_id)
+        self.bookings_version += 1
+        return client_id
+    
+    def add_clients(self, bookings):
+        """Записывает пачку (telegram_id, first_name, phone_number, service_id) одной транзакцией.
+        
+        Возвращает для каждой записи её id или исключение: ошибочная строка
+        откатывается до своей точки сохранения и не отменяет остальные.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                results = [self._insert_booking(cursor, *booking) for booking in bookings]
+            except sqlite3.Error:
+                # Ошибки редки: только тогда повторяем пачку с точкой сохранения на каждую строку
+                conn.rollback()
+                results = self._insert_bookings_isolated(cursor, bookings)
+        self.bookings_version += 1
+        return results
+    
+    def _insert_bookings_isolated(self, cursor, bookings):
+        results = []
+        # Без явного BEGIN внешняя точка сохранения сама фиксировала бы каждую строку
+        cursor.execute('BEGIN')
+        for booking in bookings:
+            cursor.execute('SAVEPOINT booking')
+            try:
+                results.append(self._insert_booking(cursor, *booking))
+            except sqlite3.Error as e:
+                cursor.execute('ROLLBACK TO booking')
+                results.append(e)
+            cursor.execute('RELEASE booking')
+        return results
+    
+    def book_slot(self, telegram_id, first_name, phone_number, service_id, master_id, starts_at, ends_at):
+        # Проверка пересечения и запись выполняются под одной блокировкой писателя
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT INTO clients (telegram_id, first_name, phone_number, service_id)
+                SELECT 1 FROM appointments
+                WHERE master_id = ? AND ends_at > ? AND starts_at < ?
+                LIMIT 1
+            ''', (master_id, starts_at, ends_at))
+            if cursor.fetchone():
+                return None
+            
+            client_id = self._insert_booking(cursor, telegram_id, first_name, phone_number, service_id)
+            cursor.execute('''
+                INSERT INTO appointments (booking_id, master_id, starts_at, ends_at)
                 VALUES (?, ?, ?, ?)
-            ''', (telegram_id, first_name, phone_number, service_id))
-            conn.commit()
-            return cursor.lastrowid
+            ''', (client_id, master_id, starts_at, ends_at))
+        self.bookings_version += 1
+        return client_id
+    
+    def _insert_booking(self, cursor, telegram_id, first_name, phone_number, service_id):
+        # Клиент хранится один раз: имя и телефон обновляются данными последней записи,
+        # а телефон самой записи остаётся в bookings
+        phone = normalize_phone(phone_number)
+        cursor.execute('''
+            INSERT INTO customers (telegram_id, first_name, phone)
+            VALUES (?, ?, ?)
+            ON CONFLICT (telegram_id) DO UPDATE SET
+                first_name = excluded.first_name,
+                phone = excluded.phone,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (telegram_id, first_name, phone))
+        cursor.execute('''
+            INSERT INTO bookings (customer_id, service_id, price, phone)
+            VALUES (?, ?, (SELECT price FROM services WHERE id = ?), ?)
+        ''', (telegram_id, service_id, service_id, phone))
+        client_id = cursor.lastrowid
+        
+        # Агрегаты обновляются в той же транзакции, что и запись клиента; день — местная дата, как в отчётах
+        cursor.execute('''
+            INSERT INTO booking_stats_daily (day, service_id, bookings, revenue)
+            SELECT date(created_at, 'localtime'), COALESCE(service_id, 0), 1, COALESCE(price, 0)
+            FROM bookings
+            WHERE id = ?
+            ON CONFLICT (day, service_id) DO UPDATE SET
+                bookings = bookings + 1,
+                revenue = revenue + excluded.revenue
+        ''', (client_id,))
+        return client_id
+    
+    @property
+    def data_version(self):
+        # Меняется при каждой новой записи и правке каталога; ключ кэша отчётов
+        return (self.catalog_version, self.bookings_version)
     
     def get_clients(self, days=30):
-        with self.get_connection() as conn:
+        with self.read_connection() as conn:
             cursor = conn.cursor()
             if days:
-                cursor.execute('''
-                    SELECT c.*, s.name as service_name, s.category 
+                cursor.execute(f'''
+                    SELECT {CLIENT_COLUMNS}, s.name as service_name, s.category 
                     FROM clients c 
                     LEFT JOIN services s ON c.service_id = s.id 
-                    WHERE date(c.created_at) >= date('now', ?)
+                    WHERE c.created_at >= date('now', ?)
                     ORDER BY c.created_at DESC
                 ''', (f'-{days} days',))
             else:
-                cursor.execute('''
-                    SELECT c.*, s.name as service_name, s.category 
+                cursor.execute(f'''
+                    SELECT {CLIENT_COLUMNS}, s.name as service_name, s.category 
                     FROM clients c 
                     LEFT JOIN services s ON c.service_id = s.id 
                     ORDER BY c.created_at DESC
                 ''')
             return cursor.fetchall()
     
+    def get_clients_page(self, days=None, cursor=None, direction='next', limit=50):
+        # Keyset-пагинация по (created_at, id): next — к более старым записям, prev — к более новым
+        conditions, params = [], []
+        if days:
+            conditions.append("c.created_at >= date('now', ?)")
+            params.append(f'-{days} days')
+        if cursor:
+            conditions.append(f"(c.created_at, c.id) {'<' if direction == 'next' else '>'} (?, ?)")
+            params.extend(cursor)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        order = 'DESC' if direction == 'next' else 'ASC'
+        
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {CLIENT_COLUMNS}, s.name as service_name, s.category 
+                FROM clients c 
+                LEFT JOIN services s ON c.service_id = s.id 
+                {where}
+                ORDER BY c.created_at {order}, c.id {order}
+                LIMIT ?
+            ''', (*params, limit))
+            return cursor.fetchall()
+    
+    def search_clients(self, text, cursor=None, direction='next', limit=50):
+        # Запрос только из цифр и разделителей ищется по телефону, остальное — по имени
+        digits = ''.join(char for char in text if char.isdigit())
+        if digits and not text.strip(PHONE_SEPARATORS + '0123456789'):
+            # Полный номер приводим к тому же виду, что и в базе: 8 900… ищется как 7900…
+            if len(digits) >= 10:
+                digits = normalize_phone(digits).lstrip('+')
+            match = f'phone : "{digits}"'
+        else:
+            match = 'first_name : "{}"'.format(text.strip().replace('"', '""'))
+        
+        # Пагинация по id записи: next — к более старым записям, prev — к более новым
+        condition, params = '', [match]
+        if cursor:
+            condition = f"AND c.id {'<' if direction == 'next' else '>'} ?"
+            params.append(cursor)
+        order = 'DESC' if direction == 'next' else 'ASC'
+        
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {CLIENT_COLUMNS}, s.name as service_name, s.category
+                FROM clients c
+                LEFT JOIN services s ON c.service_id = s.id
+                WHERE c.telegram_id IN (SELECT rowid FROM customers_fts WHERE customers_fts MATCH ?) {condition}
+                ORDER BY c.id {order}
+                LIMIT ?
+            ''', (*params, limit))
+            return cursor.fetchall()
+    
+    def iter_clients_export(self, days=None, chunk_size=1000):
+        # Строки отдаются пачками по chunk_size: в памяти не больше одной пачки
+        condition, params = '', ()
+        if days:
+            condition, params = "WHERE c.created_at >= date('now', ?)", (f'-{days} days',)
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT c.id, c.created_at, c.first_name, c.phone_number, c.telegram_id,
+                       s.category, s.name, c.price
+                FROM clients c
+                LEFT JOIN services s ON c.service_id = s.id
+                {condition}
+                ORDER BY c.id
+            ''', params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+    
+    def get_booking_stats(self, start, end):
+        # Читает только агрегаты, поэтому стоимость не зависит от размера истории
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT s.category, s.name, SUM(a.bookings), SUM(a.revenue)
+                FROM booking_stats_daily a
+                LEFT JOIN services s ON a.service_id = s.id
+                WHERE a.day BETWEEN ? AND ?
+                GROUP BY a.service_id
+                ORDER BY s.category, s.name
+            ''', (start, end))
+            return cursor.fetchall()
+    
+    def get_report_data(self, start, end):
+        # Границы периода включительно, даты в формате YYYY-MM-DD
+        by_service = self.get_booking_stats(start, end)
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT day, SUM(bookings), SUM(revenue)
+                FROM booking_stats_daily
+                WHERE day BETWEEN ? AND ?
+                GROUP BY day
+                ORDER BY day
+            ''', (start, end))
+            by_day = cursor.fetchall()
+            return by_service, by_day
+    
+    def backfill_stats(self):
+        # Полный пересчёт агрегатов по таблице записей
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            return backfill_booking_stats(cursor)
+    
     def update_service(self, service_id, name, price, duration):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                UPDATE services SET name = ?, price = ?, duration = ?
+                UPDATE services SET name = ?, price = ?, duration = ?, duration_minutes = ?
                 WHERE id = ?
-            ''', (name, price, duration, service_id))
-            conn.commit()
+            ''', (name, price, duration, parse_duration(duration), service_id))
+        self.bump_catalog_version()
     
     def delete_service(self, service_id):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('UPDATE services SET is_active = FALSE WHERE id = ?', (service_id,))
-            conn.commit()
+        self.bump_catalog_version()
     
     def add_service(self, category, name, price, duration):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT INTO services (category, name, price, duration)
-                VALUES (?, ?, ?, ?)
-            ''', (category, name, price, duration))
-            conn.commit()
-            return cursor.lastrowid
+                INSERT INTO services (category, name, price, duration, duration_minutes)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (category, name, price, duration, parse_duration(duration)))
+            service_id = cursor.lastrowid
+        self.bump_catalog_version()
+        return service_id
+    
+    def bump_catalog_version(self):
+        # Версия меняется после фиксации транзакции, чтобы кэш каталога перечитал новые данные
+        self.catalog_version += 1
     
     def get_setting(self, key):
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        return self.settings.get(key)
     
     def update_setting(self, key, value):
         with self.get_connection() as conn:
@@ -170,18 +921,350 @@ class Database:
                 INSERT OR REPLACE INTO settings (key, value)
                 VALUES (?, ?)
             ''', (key, value))
-            conn.commit()
+        self.settings.set(key, value)
     
-    def get_all_services(self):
+    def reload_settings(self):
+        # Перечитываем настройки, если файл базы изменили в обход бота
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT key, value FROM settings')
+            self.settings.load(cursor.fetchall())
+    
+    def get_schedule(self):
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, name FROM masters WHERE is_active = TRUE ORDER BY id')
+            masters = cursor.fetchall()
+            cursor.execute('''
+                SELECT w.master_id, w.weekday, w.start_minute, w.end_minute
+                FROM working_hours w
+                JOIN masters m ON m.id = w.master_id
+                WHERE m.is_active = TRUE
+                ORDER BY w.master_id, w.weekday, w.start_minute
+            ''')
+            return masters, cursor.fetchall()
+    
+    def get_appointments(self, since):
+        # Только записи, которые ещё не закончились к моменту since
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT master_id, starts_at, ends_at FROM appointments
+                WHERE ends_at > ?
+                ORDER BY master_id, starts_at
+            ''', (since,))
+            return cursor.fetchall()
+    
+    def add_master(self, name):
         with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('INSERT INTO masters (name) VALUES (?)', (name,))
+            return cursor.lastrowid
+    
+    def set_working_hours(self, master_id, hours):
+        # hours: [(weekday, start_minute, end_minute)], заменяет прежнее расписание мастера
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM working_hours WHERE master_id = ?', (master_id,))
+            cursor.executemany('''
+                INSERT INTO working_hours (master_id, weekday, start_minute, end_minute)
+                VALUES (?, ?, ?, ?)
+            ''', [(master_id, *item) for item in hours])
+    
+    def get_all_services(self):
+        with self.read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM services WHERE is_active = TRUE ORDER BY category, name')
             return cursor.fetchall()
     
     def get_all_client_ids(self):
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT telegram_id FROM customers')
+            return [row[0] for row in cursor.fetchall()]
+    
+    def create_broadcast(self, message, admin_id):
+        # Список получателей фиксируется сразу: каждый telegram_id ровно один раз
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT DISTINCT telegram_id FROM clients')
+            cursor.execute('''
+                INSERT INTO broadcasts (message, admin_id)
+                VALUES (?, ?)
+            ''', (message, admin_id))
+            broadcast_id = cursor.lastrowid
+            cursor.execute('''
+                INSERT INTO broadcast_recipients (broadcast_id, telegram_id)
+                SELECT ?, telegram_id FROM customers
+            ''', (broadcast_id,))
+            return broadcast_id
+    
+    def get_active_broadcasts(self):
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, message, admin_id FROM broadcasts WHERE status = 'running' ORDER BY id")
+            return cursor.fetchall()
+    
+    def get_pending_recipients(self, broadcast_id):
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT telegram_id FROM broadcast_recipients
+                WHERE broadcast_id = ? AND status = 'pending'
+            ''', (broadcast_id,))
             return [row[0] for row in cursor.fetchall()]
+    
+    def set_recipient_status(self, broadcast_id, telegram_id, status, attempts, error=None):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE broadcast_recipients
+                SET status = ?, attempts = attempts + ?, error = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE broadcast_id = ? AND telegram_id = ?
+            ''', (status, attempts, error, broadcast_id, telegram_id))
+    
+    def get_broadcast_stats(self, broadcast_id):
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT status, COUNT(*) FROM broadcast_recipients
+                WHERE broadcast_id = ?
+                GROUP BY status
+            ''', (broadcast_id,))
+            return dict(cursor.fetchall())
+    
+    def finish_broadcast(self, broadcast_id):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE broadcasts SET status = 'done', finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (broadcast_id,))
+    
+    def load_persistence(self, kind, since):
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT key, data, updated_at FROM persistence_data
+                WHERE kind = ? AND updated_at >= ?
+            ''', (kind, since))
+            return cursor.fetchall()
+    
+    def save_persistence(self, upserts, deletes):
+        # Все накопленные изменения записываются одной транзакцией
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT OR REPLACE INTO persistence_data (kind, key, data, updated_at)
+                VALUES (?, ?, ?, ?)
+            ''', upserts)
+            cursor.executemany('DELETE FROM persistence_data WHERE kind = ? AND key = ?', deletes)
+    
+    def purge_persistence(self, before):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM persistence_data WHERE updated_at < ?', (before,))
+            return cursor.rowcount
+    
+    def add_job(self, kind, run_at, payload, dedupe_key=None):
+        # Возвращает id задачи или None, если задача с таким dedupe_key уже есть
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR IGNORE INTO jobs (kind, run_at, payload, dedupe_key)
+                VALUES (?, ?, ?, ?)
+            ''', (kind, run_at, payload, dedupe_key))
+            return cursor.lastrowid if cursor.rowcount else None
+    
+    def get_pending_jobs(self):
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT run_at, id FROM jobs WHERE status = 'pending'")
+            return cursor.fetchall()
+    
+    def interrupt_running_jobs(self):
+        # Задачи, прерванные остановкой, повторно не запускаются: лучше пропустить напоминание, чем отправить два
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs SET status = 'interrupted', finished_at = strftime('%s', 'now')
+                WHERE status = 'running'
+            ''')
+            return cursor.rowcount
+    
+    def claim_jobs(self, job_ids):
+        # Захват до запуска: задачу выполнит только тот, кто перевёл её из pending в running
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            placeholders = ', '.join('?' * len(job_ids))
+            cursor.execute(f'''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1
+                WHERE id IN ({placeholders}) AND status = 'pending'
+                RETURNING id, kind, run_at, payload
+            ''', job_ids)
+            return cursor.fetchall()
+    
+    def finish_job(self, job_id, status, error=None):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs SET status = ?, error = ?, finished_at = strftime('%s', 'now')
+                WHERE id = ?
+            ''', (status, error, job_id))
+    
+    def run_maintenance(self, jobs_before):
+        # Ночное обслуживание: чистка завершённых задач, статистика планировщика и сброс WAL
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM jobs WHERE status != 'pending' AND finished_at < ?", (jobs_before,))
+            deleted = cursor.rowcount
+        with self.get_connection() as conn:
+            conn.execute('PRAGMA optimize')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return deleted
+
+class GroupCommitWriter:
+    """Собирает записи от одновременных обработчиков и сохраняет их одной транзакцией.
+    
+    Пачка уходит в базу через delay секунд после первой записи или сразу по
+    достижении max_batch строк; пока пачка пишется, следующая копится. Каждый
+    вызов submit получает свой результат (id или исключение) через future.
+    """
+    
+    def __init__(self, write_batch, delay=None, max_batch=None):
+        self.write_batch = write_batch
+        self.delay = (config.BOOKING_BATCH_DELAY if delay is None else delay) / 1000
+        self.max_batch = max_batch or config.BOOKING_BATCH_SIZE
+        # (аргументы, future) в порядке поступления
+        self._pending = []
+        self._full = asyncio.Event()
+        self._task = None
+    
+    def submit(self, *args):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((args, future))
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        elif len(self._pending) >= self.max_batch:
+            self._full.set()
+        return future
+    
+    async def _run(self):
+        try:
+            while self._pending:
+                if len(self._pending) < self.max_batch:
+                    try:
+                        await asyncio.wait_for(self._full.wait(), self.delay)
+                    except asyncio.TimeoutError:
+                        pass
+                self._full.clear()
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+                await self._write(batch)
+        finally:
+            self._task = None
+    
+    async def _write(self, batch):
+        try:
+            results = await self.write_batch([args for args, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        
+        for (_, future), result in zip(batch, results):
+            # Обработчик мог быть отменён, но его запись уже сохранена
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+    
+    async def flush(self):
+        """Дожидается записи всего, что уже передано в submit."""
+        while self._task is not None:
+            self._full.set()
+            await asyncio.shield(self._task)
+    
+    def drain(self):
+        # Остаток без цикла событий (закрытие базы): вызывающих уже некому уведомить
+        pending, self._pending = self._pending, []
+        return [args for args, _ in pending]
+
+class AsyncDatabase:
+    """Асинхронный вариант Database для обработчиков бота.
+    
+    Каждый метод Database доступен как корутина и выполняется в отдельном
+    пуле потоков, поэтому медленный запрос не останавливает цикл событий.
+    """
+    
+    def __init__(self, database, workers=None, executor=None):
+        self.database = database
+        # Общий пул потоков (несколько салонов) закрывает не база, а процесс
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=workers or database.pool.size + 1,
+            thread_name_prefix='db'
+        )
+        # Записи клиентов во время наплыва фиксируются пачками, а не по одной
+        self._bookings = GroupCommitWriter(self.add_clients)
+    
+    def __getattr__(self, name):
+        attr = getattr(self.database, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        
+        call_histogram = metrics.histogram('bot_db_call_duration_seconds', method=name)
+        wait_histogram = metrics.histogram('bot_db_wait_seconds', method=name)
+        
+        def timed(submitted, *args, **kwargs):
+            started = time.perf_counter()
+            wait_histogram.observe(started - submitted)
+            try:
+                return attr(*args, **kwargs)
+            except Exception:
+                metrics.inc('bot_db_errors_total', method=name)
+                raise
+            finally:
+                call_histogram.observe(time.perf_counter() - started)
+        
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(timed, time.perf_counter(), *args, **kwargs))
+        
+        call.__name__ = name
+        return call
+    
+    async def add_client(self, telegram_id, first_name, phone_number, service_id):
+        return await self._bookings.submit(telegram_id, first_name, phone_number, service_id)
+    
+    async def flush(self):
+        await self._bookings.flush()
+    
+    def close(self):
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+        leftover = self._bookings.drain()
+        if leftover:
+            self.database.add_clients(leftover)
+        self.database.close()
+
+_shared_executor = None
+_shared_executor_lock = threading.Lock()
+
+def shared_executor():
+    """Пул потоков, общий для баз всех салонов: потоков столько, сколько нужно процессу, а не салонам."""
+    global _shared_executor
+    with _shared_executor_lock:
+        if _shared_executor is None:
+            _shared_executor = ThreadPoolExecutor(max_workers=config.TENANT_DB_WORKERS, thread_name_prefix='db')
+        return _shared_executor
+
+def close_shared_executor():
+    global _shared_executor
+    with _shared_executor_lock:
+        if _shared_executor is not None:
+            _shared_executor.shutdown(wait=True)
+            _shared_executor = None
 
-db = Database()
\ No newline at end of file
+# У каждого салона свой файл базы; без салонов — одна база, как раньше
+db = TenantLocal(lambda tenant: Database(config.DATABASE_PATH, pool_size=config.DATABASE_READERS))
+adb = TenantLocal(lambda tenant: AsyncDatabase(db.resolve(), executor=shared_executor() if tenant else None))
+settings = TenantLocal(lambda tenant: db.settings)
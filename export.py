@@ -0,0 +1,63 @@
+import os
+import csv
+import asyncio
+import tempfile
+import importlib.util
+from datetime import date
+from database import db
+
+EXPORT_COLUMNS = ['ID', 'Дата записи', 'Имя', 'Телефон', 'Telegram ID', 'Категория', 'Услуга', 'Цена, руб.']
+CHUNK_SIZE = 1000
+
+def xlsx_available():
+    return importlib.util.find_spec('openpyxl') is not None
+
+def write_csv(database, path, days=None, chunk_size=CHUNK_SIZE):
+    count = 0
+    # utf-8-sig, чтобы Excel правильно открыл кириллицу
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in database.iter_clients_export(days, chunk_size):
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+def write_xlsx(database, path, days=None, chunk_size=CHUNK_SIZE):
+    from openpyxl import Workbook
+
+    # write_only не держит лист в памяти: строки сразу уходят во временный файл
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Клиенты')
+    sheet.append(EXPORT_COLUMNS)
+    count = 0
+    for rows in database.iter_clients_export(days, chunk_size):
+        for row in rows:
+            sheet.append(row)
+        count += len(rows)
+    workbook.save(path)
+    return count
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx}
+
+def export_clients(path, fmt='csv', days=None, database=db):
+    """Выгружает клиентов в файл и возвращает число строк. Блокирующая функция."""
+    if fmt == 'xlsx' and not xlsx_available():
+        raise RuntimeError('Для выгрузки в XLSX установите пакет openpyxl')
+    return WRITERS[fmt](database, path, days)
+
+async def export_to_tempfile(fmt='csv', days=None):
+    """Выгружает клиентов во временный файл в отдельном потоке.
+
+    Возвращает (путь, имя файла для отправки, число строк); файл удаляет вызывающий.
+    """
+    fd, path = tempfile.mkstemp(suffix=f'.{fmt}')
+    os.close(fd)
+    loop = asyncio.get_running_loop()
+    try:
+        # Поток не знает текущего салона: передаём базу явно
+        count = await loop.run_in_executor(None, export_clients, path, fmt, days, db.resolve())
+    except Exception:
+        os.remove(path)
+        raise
+    return path, f"clients_{date.today():%Y-%m-%d}.{fmt}", count
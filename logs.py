@@ -0,0 +1,123 @@
+import os
+import gzip
+import json
+import queue
+import atexit
+import shutil
+import logging
+import logging.handlers
+import multiprocessing
+from contextvars import ContextVar
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Текущее обновление и обработчик; выставляются в PerChatUpdateProcessor и обёртке обработчиков
+current_update_id = ContextVar('current_update_id', default=None)
+current_handler = ContextVar('current_handler', default=None)
+CONTEXT_FIELDS = (('update_id', current_update_id), ('handler', current_handler))
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """Кладёт запись в очередь, не касаясь диска, и добавляет к ней контекст обновления.
+
+    Сообщение и трассировка форматируются здесь, в вызывающем потоке: аргументы
+    записи могут измениться к моменту, когда до неё доберётся поток записи.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        for field, variable in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, variable.get())
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON."""
+
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field, _ in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        if record.exc_text:
+            payload['exception'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+def gzip_namer(name):
+    return name + '.gz'
+
+def gzip_rotator(source, destination):
+    # Выполняется в потоке QueueListener, цикл событий сжатия не ждёт
+    with open(source, 'rb') as src, gzip.open(destination, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+def build_file_handler(settings):
+    if settings.LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            settings.LOG_FILE,
+            when=settings.LOG_ROTATE_WHEN,
+            backupCount=settings.LOG_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            settings.LOG_FILE,
+            maxBytes=settings.LOG_MAX_BYTES,
+            backupCount=settings.LOG_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+    if settings.LOG_COMPRESS:
+        handler.namer = gzip_namer
+        handler.rotator = gzip_rotator
+    return handler
+
+_listener = None
+
+def setup_logging(settings):
+    """Настраивает корневой логгер: очередь в памяти и отдельный поток записи в файл и консоль.
+
+    Как и logging.basicConfig, ничего не делает, если логирование уже настроено.
+    """
+    global _listener
+
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    # Процессы пула отчётов заново импортируют главный модуль бота, а с ним и config:
+    # файл журнала и поток записи есть только у основного процесса
+    if multiprocessing.current_process().name != 'MainProcess':
+        return
+
+    formatter = JsonFormatter() if settings.LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = []
+    if settings.LOG_FILE:
+        handlers.append(build_file_handler(settings))
+    if settings.LOG_CONSOLE:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # Очередь без ограничения: запись в лог никогда не ждёт диска
+    log_queue = queue.SimpleQueue()
+    queue_handler = ContextQueueHandler(log_queue)
+    queue_handler.setFormatter(formatter)
+    root.addHandler(queue_handler)
+    root.setLevel(settings.LOG_LEVEL)
+    # httpx пишет INFO на каждый запрос к Bot API
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Дописываем очередь при выходе из процесса
+    atexit.register(_listener.stop)
@@ -1,54 +1,112 @@
+import sys
+import signal
+import asyncio
+import contextvars
 import logging
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler
-from config import config
-from client import start, handle_message, get_phone, cancel, PHONE
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters, ConversationHandler
+from telegram.request import HTTPXRequest
+from config import config, load_tenants
+from database import db, adb, shared_executor, close_shared_executor
+from broadcast import broadcaster
+from notifications import notifier
+from webhook import run_webhook
+from update_processor import PerChatUpdateProcessor
+from persistence import persistence
+from reports import reports
+from scheduler import scheduler
+from metrics import exporter, instrument_handlers, TimedRequest
+from ratelimit import throttle
+from tenants import current_tenant
+from client import start, handle_message, get_phone, slot_handler, cancel, PHONE, SLOT
 from admin import (
     admin_panel, admin_handler, admin_cancel, ADMIN_MAIN,
     edit_category_handler, edit_service_select_handler, edit_service_details_handler,
     delete_category_handler, delete_service_select_handler, delete_service_confirm_handler,
     add_category_handler, add_service_name_handler, add_service_price_handler, add_service_duration_handler,
     edit_channel_handler, edit_website_handler, edit_location_lat_handler, edit_location_lon_handler,
-    edit_welcome_handler, send_message_handler,
+    edit_welcome_handler, send_message_handler, clients_page_callback, report_range_handler,
+    export_format_handler, search_query_handler, search_page_callback, stats_command,
+    schedule_time_handler, schedule_message_handler,
     EDIT_CATEGORY, EDIT_SERVICE_SELECT, EDIT_SERVICE_DETAILS,
     DELETE_CATEGORY, DELETE_SERVICE_SELECT, DELETE_SERVICE_CONFIRM,
     ADD_CATEGORY, ADD_SERVICE_NAME, ADD_SERVICE_PRICE, ADD_SERVICE_DURATION,
     EDIT_CHANNEL, EDIT_WEBSITE, EDIT_LOCATION_LAT, EDIT_LOCATION_LON,
-    EDIT_WELCOME, SEND_MESSAGE
-)
-
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    filename='bot.log'
+    EDIT_WELCOME, SEND_MESSAGE, REPORT_RANGE, EXPORT_FORMAT, SEARCH_QUERY,
+    SCHEDULE_TIME, SCHEDULE_MESSAGE
 )
 
 # Глобальная переменная для доступа к application из других модулей
 application = None
 
-def main():
-    global application
+async def post_init(application: Application):
+    # По SIGHUP перечитываем настройки, если базу изменили в обход бота; салоны — в run_tenants
+    if hasattr(signal, 'SIGHUP') and current_tenant.get() is None:
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(adb.reload_settings()))
     
-    if not config.BOT_TOKEN:
-        logging.error("BOT_TOKEN not found!")
-        return
+    await exporter.start()
+    notifier.start(application.bot)
+    persistence.start_eviction(application)
     
-    application = Application.builder().token(config.BOT_TOKEN).build()
+    # Продолжаем рассылки, прерванные остановкой бота
+    await broadcaster.resume(application.bot)
+    await scheduler.start(application.bot)
+
+async def post_stop(application: Application):
+    # Бот ещё доступен: дописываем уведомления и ставим рассылки на паузу
+    await scheduler.stop()
+    await broadcaster.stop()
+    await notifier.stop(application.bot)
+    await persistence.stop_eviction()
+    # Метрики общие для всех салонов: их останавливает run_tenants, когда завершатся все
+    if current_tenant.get() is None:
+        await exporter.stop()
+
+async def post_shutdown(application: Application):
+    # Процессы отчётов тоже общие и закрываются в run_tenants
+    if current_tenant.get() is None:
+        reports.close()
     
-    # Обработчик команды /start
-    application.add_handler(CommandHandler('start', start))
+    # Дописываем накопленные записи, дожидаемся незавершённых запросов и закрываем соединения
+    await adb.flush()
+    adb.close()
+
+def build_application(request=None):
+    """Собирает Application со всеми обработчиками; request подменяет HTTP-клиент Bot API (бенчмарки)."""
+    builder = (
+        Application.builder()
+        .token(config.BOT_TOKEN)
+        .concurrent_updates(PerChatUpdateProcessor(config.MAX_CONCURRENT_UPDATES))
+        .persistence(persistence.resolve())
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    # Вызовы Bot API замеряются; getUpdates не оборачиваем — это долгий опрос, а не задержка
+    if request is not None:
+        builder = builder.get_updates_request(request)
+    builder = builder.request(TimedRequest(request or HTTPXRequest(connection_pool_size=256)))
+    application = builder.build()
     
-    # Обработчик команды /admin
-    application.add_handler(CommandHandler('admin', admin_panel))
+    # Ограничение частоты до всех остальных обработчиков: лишние обновления не доходят до базы
+    application.add_handler(TypeHandler(Update, throttle.check), group=-1)
     
-    # ConversationHandler для клиентов
+    # ConversationHandler для клиентов; /start обрабатывается здесь же, чтобы сбросить начатую запись
     client_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)],
+        entry_points=[
+            CommandHandler('start', start),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message),
+        ],
         states={
             PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_phone)],
+            SLOT: [MessageHandler(filters.TEXT & ~filters.COMMAND, slot_handler)],
         },
-        fallbacks=[CommandHandler('cancel', cancel)],
-        allow_reentry=True
+        fallbacks=[CommandHandler('cancel', cancel), CommandHandler('start', start)],
+        # Повторный вход перехватывал бы ввод телефона: точка входа принимает любой текст
+        allow_reentry=False,
+        name='client_conversation',
+        persistent=True
     )
     
     # ConversationHandler для администраторов
@@ -80,21 +138,124 @@ def main():
             EDIT_LOCATION_LON: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_location_lon_handler)],
             EDIT_WELCOME: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_welcome_handler)],
             SEND_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, send_message_handler)],
+            
+            # Отчёты
+            REPORT_RANGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, report_range_handler)],
+            EXPORT_FORMAT: [MessageHandler(filters.TEXT & ~filters.COMMAND, export_format_handler)],
+            SEARCH_QUERY: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_query_handler)],
+            SCHEDULE_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, schedule_time_handler)],
+            SCHEDULE_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, schedule_message_handler)],
         },
         fallbacks=[CommandHandler('cancel', admin_cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        name='admin_conversation',
+        persistent=True
     )
     
-    # Добавляем обработчики
-    application.add_handler(client_conv_handler)
+    # Добавляем обработчики: админ-диалог первым, иначе его шаги забирает клиентский диалог
     application.add_handler(admin_conv_handler)
+    application.add_handler(client_conv_handler)
+    
+    # Листание списка клиентов
+    application.add_handler(CallbackQueryHandler(clients_page_callback, pattern=r'^clients:'))
+    application.add_handler(CallbackQueryHandler(search_page_callback, pattern=r'^search:'))
     
     # Обработчик для текстовых сообщений (fallback)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
+    # Метрики производительности для администраторов
+    application.add_handler(CommandHandler('stats', stats_command))
+    
+    instrument_handlers(application)
+    return application
+
+async def serve_tenant(tenant, stop_event):
+    # Салон наследуют все задачи, созданные отсюда: опрос, обработка обновлений, фоновые циклы
+    current_tenant.set(tenant)
+    try:
+        # Открытие базы и миграции блокируют поток: выполняем их в общем пуле до запуска опроса.
+        # Потоки пула не наследуют салон, поэтому вызов идёт в копии текущего контекста
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(shared_executor(), contextvars.copy_context().run, db.resolve)
+        application = build_application()
+        async with application:
+            await application.post_init(application)
+            await application.start()
+            await application.updater.start_polling()
+            logging.info(f"Tenant {tenant.name} started")
+            try:
+                await stop_event.wait()
+            finally:
+                await application.updater.stop()
+                await application.stop()
+                await application.post_stop(application)
+        await application.post_shutdown(application)
+    except Exception as e:
+        # Ошибка одного салона (например, неверный токен) не останавливает остальные
+        logging.error(f"Tenant {tenant.name} stopped with error: {e}")
+
+async def reload_tenant_settings(tenants):
+    for tenant in tenants:
+        token = current_tenant.set(tenant)
+        try:
+            await adb.reload_settings()
+        finally:
+            current_tenant.reset(token)
+
+async def run_tenants(tenants):
+    """Все салоны из TENANTS_FILE в одном процессе: у каждого свой Application и своя база."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    if hasattr(signal, 'SIGHUP'):
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(reload_tenant_settings(tenants)))
+    
+    logging.info(f"Starting {len(tenants)} tenants")
+    try:
+        await asyncio.gather(*(serve_tenant(tenant, stop_event) for tenant in tenants))
+    finally:
+        # Общие ресурсы закрываются один раз, после остановки всех салонов
+        await exporter.stop()
+        reports.close()
+        close_shared_executor()
+
+def main():
+    global application
+    
+    if config.TENANTS_FILE:
+        if config.BOT_MODE == 'webhook':
+            logging.warning("Webhook mode is not supported with TENANTS_FILE, using polling")
+        try:
+            tenants = load_tenants(config.TENANTS_FILE)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error loading tenants from {config.TENANTS_FILE}: {e}")
+            sys.exit(1)
+        asyncio.run(run_tenants(tenants))
+        return
+    
+    if not config.BOT_TOKEN:
+        logging.error("BOT_TOKEN not found!")
+        return
+    
+    # База открывается и мигрирует до запуска: при ошибке миграции бот не стартует
+    try:
+        db.resolve()
+    except Exception:
+        logging.error("Database is not ready, bot is not started")
+        sys.exit(1)
+    
+    application = build_application()
+    
     # Запускаем бота
     logging.info("Бот запущен...")
-    application.run_polling()
+    if config.BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
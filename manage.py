@@ -0,0 +1,74 @@
+import os
+import sys
+import argparse
+from database import db
+from export import WRITERS, export_clients
+
+def migrate(args):
+    # Миграции применяются при открытии базы; команда позволяет выполнить их заранее
+    try:
+        version = db.get_schema_version()
+    except Exception as e:
+        sys.exit(f"Migration failed: {e}")
+    print(f"Schema version: {version}")
+
+def backfill_stats(args):
+    rows = db.backfill_stats()
+    print(f"Aggregates rebuilt: {rows} rows")
+
+def export(args):
+    fmt = args.format or os.path.splitext(args.path)[1].lstrip('.').lower() or 'csv'
+    if fmt not in WRITERS:
+        sys.exit(f"Unknown export format: {fmt}")
+    count = export_clients(args.path, fmt, args.days)
+    print(f"Exported {count} rows to {args.path}")
+
+def parse_hours(spec):
+    # "0-5 10:00-20:00": дни недели (0 — понедельник) и время работы
+    days, hours = spec.split()
+    first, _, last = days.partition('-')
+    opens, closes = (int(h) * 60 + int(m) for h, m in (part.split(':') for part in hours.split('-')))
+    return [(weekday, opens, closes) for weekday in range(int(first), int(last or first) + 1)]
+
+def add_master(args):
+    master_id = db.add_master(args.name)
+    if args.hours:
+        db.set_working_hours(master_id, [item for spec in args.hours for item in parse_hours(spec)])
+    print(f"Master {args.name} added with id {master_id}")
+
+def set_hours(args):
+    db.set_working_hours(args.master_id, [item for spec in args.hours for item in parse_hours(spec)])
+    print(f"Working hours of master {args.master_id} updated")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Обслуживание базы данных бота')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('migrate', help='применить миграции схемы')
+    command.set_defaults(handler=migrate)
+
+    command = commands.add_parser('backfill-stats', help='пересчитать агрегаты по таблице записей')
+    command.set_defaults(handler=backfill_stats)
+
+    command = commands.add_parser('export', help='выгрузить клиентов и записи в CSV или XLSX')
+    command.add_argument('path', help='файл для выгрузки; формат определяется по расширению')
+    command.add_argument('--format', choices=sorted(WRITERS), help='формат файла, если расширение другое')
+    command.add_argument('--days', type=int, help='только записи за последние N дней')
+    command.set_defaults(handler=export)
+
+    command = commands.add_parser('add-master', help='добавить мастера')
+    command.add_argument('name')
+    command.add_argument('--hours', nargs='*', default=[], help='расписание вида "0-5 10:00-20:00"')
+    command.set_defaults(handler=add_master)
+
+    command = commands.add_parser('set-hours', help='заменить рабочие часы мастера')
+    command.add_argument('master_id', type=int)
+    command.add_argument('hours', nargs='+', help='расписание вида "0-5 10:00-20:00"')
+    command.set_defaults(handler=set_hours)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
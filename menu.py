@@ -0,0 +1,87 @@
+from telegram import ReplyKeyboardMarkup
+from catalog import catalog
+from tenants import tenant_key
+
+BACK = 'Назад'
+CATEGORIES_PER_ROW = 3
+
+def keyboard(rows):
+    return ReplyKeyboardMarkup(rows, resize_keyboard=True)
+
+def chunked(items, size):
+    return [list(items[i:i + size]) for i in range(0, len(items), size)]
+
+class Menu:
+    """Меню одной версии каталога: готовые клавиатуры и таблица маршрутов текст → действие.
+
+    Объекты создаются один раз на версию каталога и не меняются, поэтому
+    обработка сообщения сводится к поиску в словаре без новых клавиатур.
+    """
+
+    def __init__(self, snapshot, router):
+        self.version = snapshot.version
+        self.categories = tuple(snapshot.by_category)
+        category_rows = chunked(self.categories, CATEGORIES_PER_ROW)
+
+        self.main_keyboard = keyboard(category_rows + [list(router.main_buttons)])
+        self.category_keyboards = {
+            category: keyboard(rows) for category, rows in snapshot.keyboards.items()
+        }
+        self.admin_categories_keyboard = keyboard(category_rows + [[BACK]])
+
+        # Статические пункты важнее категорий, категории — названий услуг
+        self.routes = {}
+        if router.service_action:
+            for label, service_id in snapshot.by_label.items():
+                self.routes[label] = (router.service_action, snapshot.services[service_id])
+        if router.category_action:
+            for category in self.categories:
+                self.routes[category] = (router.category_action, category)
+        for text, action in router.actions.items():
+            self.routes[text] = (action, None)
+
+class MenuRouter:
+    """Собирает Menu из каталога и пересобирает его только при смене версии каталога."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.actions = {}
+        self.main_buttons = []
+        self.category_action = None
+        self.service_action = None
+        # Салон -> Menu; у каждого салона свой каталог и свои версии
+        self._menus = {}
+
+    def register(self, text, action, main=False):
+        # main=True добавляет кнопку в нижний ряд главного меню
+        self.actions[text] = action
+        if main:
+            self.main_buttons.append(text)
+        self._menus = {}
+
+    def on_category(self, action):
+        self.category_action = action
+        self._menus = {}
+
+    def on_service(self, action):
+        self.service_action = action
+        self._menus = {}
+
+    async def get(self):
+        snapshot = await self.catalog.get()
+        key = tenant_key()
+        menu = self._menus.get(key)
+        if menu is None or menu.version != snapshot.version:
+            menu = self._menus[key] = Menu(snapshot, self)
+        return menu
+
+    async def dispatch(self, update, context):
+        """Вызывает действие для текста сообщения. Возвращает (найдено, результат действия)."""
+        menu = await self.get()
+        route = menu.routes.get(update.message.text)
+        if route is None:
+            return False, None
+        action, argument = route
+        return True, await action(update, context, menu, argument)
+
+menu = MenuRouter(catalog)
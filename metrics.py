@@ -0,0 +1,271 @@
+import time
+import bisect
+import asyncio
+import logging
+import functools
+import threading
+from telegram.ext import ConversationHandler
+from telegram.request import BaseRequest
+from config import config
+from logs import current_handler
+
+# Границы корзин гистограмм в секундах: от запросов к базе до медленных вызовов Bot API
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Имя метрики -> (тип, описание) для вывода в формате Prometheus
+DEFINITIONS = {
+    'bot_update_duration_seconds': ('histogram', 'Полная обработка одного обновления Telegram'),
+    'bot_handler_duration_seconds': ('histogram', 'Время обработчика по функции и состоянию диалога'),
+    'bot_handler_errors_total': ('counter', 'Исключения в обработчиках'),
+    'bot_db_call_duration_seconds': ('histogram', 'Выполнение метода Database в потоке пула'),
+    'bot_db_wait_seconds': ('histogram', 'Ожидание свободного потока пула базы'),
+    'bot_db_errors_total': ('counter', 'Исключения в методах Database'),
+    'bot_api_request_duration_seconds': ('histogram', 'Вызовы Bot API по методу'),
+    'bot_api_errors_total': ('counter', 'Неуспешные ответы и сетевые ошибки Bot API'),
+    'bot_event_loop_lag_seconds': ('histogram', 'Опоздание цикла событий относительно таймера'),
+    'bot_throttled_total': ('counter', 'Обновления, отброшенные ограничением частоты'),
+}
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами; observe можно вызывать из любых потоков."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q):
+        # Линейная интерполяция внутри корзины, как histogram_quantile в Prometheus
+        counts, _, count = self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+class Metrics:
+    """Реестр гистограмм и счётчиков с метками."""
+
+    def __init__(self):
+        # (имя, метки) -> Histogram или [значение счётчика]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, labels, factory):
+        key = (name, tuple(sorted(labels.items())))
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, factory())
+        return series
+
+    def histogram(self, name, **labels):
+        return self._get(name, labels, Histogram)
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def inc(self, name, value=1, **labels):
+        counter = self._get(name, labels, lambda: [0])
+        with self._lock:
+            counter[0] += value
+
+    def series(self, name):
+        """Список (метки, значение) одной метрики."""
+        return [(dict(labels), value) for (series_name, labels), value in list(self._series.items()) if series_name == name]
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus 0.0.4."""
+        lines = []
+        for name, (kind, description) in DEFINITIONS.items():
+            series = self.series(name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series, key=lambda item: sorted(item[0].items())):
+                if kind == 'counter':
+                    lines.append(f"{name}{format_labels(labels)} {value[0]}")
+                    continue
+                counts, total, count = value.snapshot()
+                # Гистограммы обработчиков создаются заранее; пустые не выводим
+                if not count:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(value.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{format_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+metrics = Metrics()
+
+# Обработчики
+
+def timed_callback(callback, state=''):
+    histogram = metrics.histogram('bot_handler_duration_seconds', handler=callback.__name__, state=state)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        token = current_handler.set(callback.__name__)
+        try:
+            return await callback(update, context)
+        except Exception:
+            metrics.inc('bot_handler_errors_total', handler=callback.__name__, state=state)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+            current_handler.reset(token)
+
+    wrapper.timed = True
+    return wrapper
+
+def _instrument_handler(handler, state=''):
+    if isinstance(handler, ConversationHandler):
+        for entry_point in handler.entry_points:
+            _instrument_handler(entry_point, f"{handler.name}:entry")
+        for conversation_state, handlers in handler.states.items():
+            for state_handler in handlers:
+                _instrument_handler(state_handler, f"{handler.name}:{conversation_state}")
+        for fallback in handler.fallbacks:
+            _instrument_handler(fallback, f"{handler.name}:fallback")
+        return
+
+    if not getattr(handler.callback, 'timed', False):
+        handler.callback = timed_callback(handler.callback, state)
+
+def instrument_handlers(application):
+    """Оборачивает обработчики Application замером времени; вызывается после add_handler."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
+
+# Bot API
+
+class TimedRequest(BaseRequest):
+    """Обёртка HTTP-клиента Bot API: время и ошибки каждого вызова по имени метода."""
+
+    def __init__(self, request):
+        self._request = request
+
+    @property
+    def read_timeout(self):
+        return self._request.read_timeout
+
+    async def initialize(self):
+        await self._request.initialize()
+
+    async def shutdown(self):
+        await self._request.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, body = await self._request.do_request(url, method, request_data, **timeouts)
+        except Exception:
+            metrics.inc('bot_api_errors_total', method=api_method, status='error')
+            raise
+        finally:
+            metrics.observe('bot_api_request_duration_seconds', time.perf_counter() - started, method=api_method)
+        if status != 200:
+            metrics.inc('bot_api_errors_total', method=api_method, status=str(status))
+        return status, body
+
+# Цикл событий и HTTP-выдача
+
+class MetricsExporter:
+    """Замер опоздания цикла событий и HTTP-страница /metrics на локальном порту."""
+
+    def __init__(self, registry, port=None, host=None, lag_interval=None):
+        self.registry = registry
+        self.port = config.METRICS_PORT if port is None else port
+        self.host = host or config.METRICS_LISTEN
+        self.lag_interval = lag_interval or config.LOOP_LAG_INTERVAL
+        self._lag_task = None
+        self._server = None
+
+    async def start(self):
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._sample_lag())
+        if self.port and self._server is None:
+            try:
+                self._server = await asyncio.start_server(self._handle, self.host, self.port)
+                logging.info(f"Metrics endpoint listening on {self.host}:{self.port}")
+            except OSError as e:
+                logging.error(f"Error starting metrics endpoint on {self.host}:{self.port}: {e}")
+
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            await asyncio.gather(self._lag_task, return_exceptions=True)
+            self._lag_task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _sample_lag(self):
+        loop = asyncio.get_running_loop()
+        histogram = self.registry.histogram('bot_event_loop_lag_seconds')
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            histogram.observe(max(0.0, loop.time() - started - self.lag_interval))
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки запроса не нужны, но их надо дочитать до пустой строки
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+exporter = MetricsExporter(metrics)
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from telegram.error import Forbidden, BadRequest, NetworkError, RetryAfter, TelegramError
+from config import config
+from tenants import TenantLocal
+from broadcast import retry_after_seconds
+
+# Ограничение Telegram на длину одного сообщения
+MESSAGE_LIMIT = 4096
+
+# Метка конца очереди, которую ставит stop
+_STOP = object()
+
+def build_digest(texts, window):
+    header = f"🗂 Новых записей за {int(window)} сек.: {len(texts)}"
+    messages = []
+    current = header
+    for text in texts:
+        if len(current) + len(text) + 2 > MESSAGE_LIMIT:
+            messages.append(current)
+            current = text
+        else:
+            current += "\n\n" + text
+    messages.append(current)
+    return messages
+
+class AdminNotifier:
+    """Очередь уведомлений администраторам с отдельным рабочим заданием.
+
+    Обработчик клиента только ставит текст в очередь; рассылка по всем
+    config.ADMIN_IDS идёт параллельно, с тайм-аутом и повторами. В режиме
+    сводки записи за окно NOTIFY_DIGEST_WINDOW собираются в одно сообщение.
+    """
+
+    def __init__(self, timeout=None, max_attempts=None, digest_window=None):
+        self.timeout = timeout or config.NOTIFY_TIMEOUT
+        self.max_attempts = max_attempts or config.NOTIFY_MAX_ATTEMPTS
+        self.digest_window = config.NOTIFY_DIGEST_WINDOW if digest_window is None else digest_window
+        self.queue = asyncio.Queue()
+        self._worker = None
+
+    def notify(self, text):
+        self.queue.put_nowait(text)
+
+    def start(self, bot):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run(bot))
+
+    async def stop(self, bot):
+        if self._worker is not None:
+            # Рабочее задание дописывает собранную сводку и очередь до метки и завершается само
+            self.queue.put_nowait(_STOP)
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+        # Уведомления, поставленные без рабочего задания или уже после метки
+        await self._deliver(bot, self._drain())
+
+    def _drain(self):
+        texts = []
+        while not self.queue.empty():
+            text = self.queue.get_nowait()
+            if text is not _STOP:
+                texts.append(text)
+        return texts
+
+    async def _collect(self, first):
+        """Тексты за окно сводки и признак того, что среди них пришла метка остановки."""
+        loop = asyncio.get_running_loop()
+        texts = [first]
+        deadline = loop.time() + self.digest_window
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                text = await asyncio.wait_for(self.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if text is _STOP:
+                return texts, True
+            texts.append(text)
+        return texts, False
+
+    async def _deliver(self, bot, texts):
+        # Несколько текстов уходят одной сводкой, если она включена
+        messages = build_digest(texts, self.digest_window) if self.digest_window and len(texts) > 1 else texts
+        for message in messages:
+            await self._fan_out(bot, message)
+
+    async def _run(self, bot):
+        stopping = False
+        while not stopping:
+            text = await self.queue.get()
+            if text is _STOP:
+                break
+            try:
+                texts = [text]
+                if self.digest_window:
+                    texts, stopping = await self._collect(text)
+                await self._deliver(bot, texts)
+            except Exception as e:
+                logging.error(f"Error delivering admin notification: {e}")
+
+    async def _fan_out(self, bot, text):
+        await asyncio.gather(*(self._send(bot, admin_id, text) for admin_id in config.ADMIN_IDS))
+
+    async def _send(self, bot, admin_id, text):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await asyncio.wait_for(bot.send_message(admin_id, text), self.timeout)
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(retry_after_seconds(e))
+            except (Forbidden, BadRequest) as e:
+                logging.error(f"Error sending message to admin {admin_id}: {e}")
+                return
+            except (asyncio.TimeoutError, NetworkError) as e:
+                logging.warning(f"Attempt {attempt} to notify admin {admin_id} failed: {e!r}")
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramError as e:
+                logging.error(f"Error sending message to admin {admin_id}: {e}")
+                return
+        logging.error(f"Giving up notifying admin {admin_id}")
+
+notifier = TenantLocal(lambda tenant: AdminNotifier())
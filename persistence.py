@@ -0,0 +1,228 @@
+import json
+import time
+import pickle
+import asyncio
+import logging
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+from config import config
+from database import adb
+from tenants import TenantLocal
+
+class SQLitePersistence(BasePersistence):
+    """Хранит user_data, chat_data и состояния ConversationHandler в базе бота.
+
+    Application передаёт изменения раз в update_interval; записи с прежним
+    содержимым пропускаются, а остальные сохраняются одной транзакцией.
+    Записи, которые не менялись дольше ttl секунд, не загружаются при старте,
+    удаляются из базы и вытесняются из памяти задачей evict_idle; у неактивных
+    пользователей она же завершает брошенные диалоги.
+    """
+
+    def __init__(self, database, ttl=None, update_interval=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval or config.PERSISTENCE_INTERVAL
+        )
+        self.database = database
+        self.ttl = ttl or config.PERSISTENCE_TTL
+        # (kind, key) -> (хэш последних записанных данных, время записи)
+        self._written = {}
+        # (kind, key) -> сериализованные данные или None для удаления
+        self._pending = {}
+        self._flush_task = None
+        # user_id -> время последней активности (time.monotonic): user_data или шаг диалога
+        self.last_seen = {}
+        self._evict_task = None
+
+    # Загрузка
+
+    async def _load(self, kind):
+        rows = await self.database.load_persistence(kind, time.time() - self.ttl)
+        for key, data, updated_at in rows:
+            self._written[(kind, key)] = (hash(data), updated_at)
+        return rows
+
+    def _touch(self, user_id, updated_at=None):
+        # updated_at — время записи в базе; активность после запуска бота считается сейчас
+        seen = time.monotonic() if updated_at is None else time.monotonic() - (time.time() - updated_at)
+        self.last_seen[user_id] = max(seen, self.last_seen.get(user_id, seen))
+
+    async def _load_data(self, kind):
+        result = {}
+        for key, data, updated_at in await self._load(kind):
+            result[int(key)] = pickle.loads(data)
+            if kind == 'user':
+                self._touch(int(key), updated_at)
+        return result
+
+    async def get_user_data(self):
+        return await self._load_data('user')
+
+    async def get_chat_data(self):
+        return await self._load_data('chat')
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        conversations = {}
+        for key, data, updated_at in await self._load(f'conversation:{name}'):
+            key = tuple(json.loads(key))
+            conversations[key] = pickle.loads(data)
+            # Диалоги бота ведутся по (chat_id, user_id): последний элемент ключа — пользователь
+            self._touch(key[-1], updated_at)
+        return conversations
+
+    # Запись
+
+    def _schedule(self, kind, key, payload):
+        # Пустые словари не храним: у большинства клиентов user_data пуст
+        if payload is None:
+            if (kind, key) not in self._written and (kind, key) not in self._pending:
+                return
+        else:
+            written = self._written.get((kind, key))
+            # Неизменные данные переписываем раз в полсрока, чтобы активные записи не устарели
+            if written and written[0] == hash(payload) and time.time() - written[1] < self.ttl / 2:
+                self._pending.pop((kind, key), None)
+                return
+
+        self._pending[(kind, key)] = payload
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        # Application вызывает update_* для всех записей сразу: даём им собраться в одну пачку
+        await asyncio.sleep(0)
+        # Изменения, пришедшие во время записи, уходят следующей пачкой
+        while self._pending and await self._write_pending():
+            pass
+
+    async def flush(self):
+        await self._write_pending()
+
+    async def _write_pending(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return True
+
+        now = time.time()
+        upserts = [(kind, key, payload, now) for (kind, key), payload in pending.items() if payload is not None]
+        deletes = [(kind, key) for (kind, key), payload in pending.items() if payload is None]
+        try:
+            await self.database.save_persistence(upserts, deletes)
+        except Exception as e:
+            logging.error(f"Error saving bot state: {e}")
+            # Возвращаем несохранённое, чтобы записать на следующем проходе
+            for item, payload in pending.items():
+                self._pending.setdefault(item, payload)
+            return False
+
+        for kind, key, payload, updated_at in upserts:
+            self._written[(kind, key)] = (hash(payload), updated_at)
+        for item in deletes:
+            self._written.pop(item, None)
+        return True
+
+    def _schedule_data(self, kind, key, data):
+        self._schedule(kind, str(key), pickle.dumps(data) if data else None)
+
+    async def update_user_data(self, user_id, data):
+        self._touch(user_id)
+        self._schedule_data('user', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._schedule_data('chat', chat_id, data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        if new_state is not None:
+            self._touch(key[-1])
+        payload = pickle.dumps(new_state) if new_state is not None else None
+        self._schedule(f'conversation:{name}', json.dumps(key), payload)
+
+    async def drop_user_data(self, user_id):
+        self.last_seen.pop(user_id, None)
+        self._schedule('user', str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._schedule('chat', str(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # Вытеснение неактивных записей
+
+    def start_eviction(self, application):
+        if self._evict_task is None:
+            self._evict_task = asyncio.create_task(self._evict_loop(application))
+
+    async def stop_eviction(self):
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            await asyncio.gather(self._evict_task, return_exceptions=True)
+            self._evict_task = None
+
+    async def _evict_loop(self, application):
+        interval = max(60, self.ttl / 10)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_idle(application)
+            except Exception as e:
+                logging.error(f"Error evicting idle bot state: {e}")
+
+    async def evict_idle(self, application):
+        deadline = time.monotonic() - self.ttl
+        idle = {user_id for user_id, seen in self.last_seen.items() if seen < deadline}
+        for user_id in idle:
+            # В личных чатах chat_id совпадает с user_id
+            application.drop_user_data(user_id)
+            application.drop_chat_data(user_id)
+            self.last_seen.pop(user_id, None)
+        ended = self._end_conversations(application, idle)
+
+        purged = await self.database.purge_persistence(time.time() - self.ttl)
+        if idle or purged:
+            logging.info(
+                f"Evicted {len(idle)} idle users and {ended} abandoned conversations from memory, "
+                f"{purged} stale rows from the database"
+            )
+
+    @staticmethod
+    def _end_conversations(application, users):
+        """Завершает диалоги пользователей users, например брошенные на вводе телефона.
+
+        conversation_timeout требует JobQueue, которой в боте нет, а публичного
+        способа завершить диалог снаружи PTB не даёт, поэтому ключи удаляются из
+        словаря диалогов напрямую. Удаление отслеживается, и при следующей записи
+        Application передаёт его в update_conversation как None.
+        """
+        if not users:
+            return 0
+        ended = 0
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if not isinstance(handler, ConversationHandler) or not handler.persistent:
+                    continue
+                conversations = handler._conversations
+                for key in [key for key in conversations if key[-1] in users]:
+                    conversations.pop(key, None)
+                    ended += 1
+        return ended
+
+persistence = TenantLocal(lambda tenant: SQLitePersistence(adb))
@@ -0,0 +1,113 @@
+import time
+import asyncio
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop
+from config import config
+from metrics import metrics
+from tenants import TenantLocal
+
+class TokenBucket:
+    """Маркерная корзина: rate маркеров в секунду, не более burst подряд."""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def try_acquire(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+    
+    def delay(self):
+        # Время до появления следующего маркера
+        return max(0.0, (1 - self.tokens) / self.rate)
+    
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+class UserThrottle:
+    """Ограничение частоты обновлений от одного пользователя.
+    
+    У каждого пользователя своя маркерная корзина; повторное нажатие той же
+    кнопки в пределах duplicate_window секунд считается одним нажатием.
+    Лишние обновления отбрасываются до обработчиков, без запросов к базе и Bot API.
+    """
+    
+    # Пустые корзины и старые нажатия вычищаются, когда пользователей становится больше
+    PRUNE_THRESHOLD = 1000
+    
+    def __init__(self, rate=None, burst=None, duplicate_window=None):
+        self.rate = rate or config.USER_RATE
+        self.burst = burst or config.USER_BURST
+        self.duplicate_window = config.DUPLICATE_WINDOW if duplicate_window is None else duplicate_window
+        # user_id -> TokenBucket
+        self._buckets = {}
+        # user_id -> (текст или callback_data, время последнего такого нажатия)
+        self._last_taps = {}
+        self._prune_at = self.PRUNE_THRESHOLD
+    
+    def allow(self, user_id, payload=None):
+        now = time.monotonic()
+        if payload is not None:
+            last = self._last_taps.get(user_id)
+            self._last_taps[user_id] = (payload, now)
+            # Окно отсчитывается от последнего нажатия: зажатая кнопка не пробьётся
+            if last and last[0] == payload and now - last[1] < self.duplicate_window:
+                metrics.inc('bot_throttled_total', reason='duplicate')
+                return False
+        
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) >= self._prune_at:
+                self._prune(now)
+        if not bucket.try_acquire():
+            metrics.inc('bot_throttled_total', reason='rate')
+            return False
+        return True
+    
+    def _prune(self, now):
+        # Полная корзина ничем не отличается от новой
+        refill_time = self.burst / self.rate
+        self._buckets = {
+            user_id: bucket for user_id, bucket in self._buckets.items()
+            if now - bucket.updated < refill_time
+        }
+        self._last_taps = {
+            user_id: tap for user_id, tap in self._last_taps.items()
+            if now - tap[1] < self.duplicate_window
+        }
+        self._prune_at = max(self.PRUNE_THRESHOLD, len(self._buckets) * 2)
+    
+    async def check(self, update, context):
+        """Обработчик группы -1: останавливает обработку лишних обновлений."""
+        user = update.effective_user
+        if user is None or user.id in config.ADMIN_IDS:
+            return
+        
+        if update.message:
+            payload = update.message.text
+        elif update.callback_query:
+            payload = update.callback_query.data
+        else:
+            payload = None
+        if not self.allow(user.id, payload):
+            if update.callback_query:
+                # Иначе у пользователя до тайм-аута крутятся часики на кнопке
+                try:
+                    await update.callback_query.answer()
+                except TelegramError:
+                    pass
+            raise ApplicationHandlerStop
+
+throttle = TenantLocal(lambda tenant: UserThrottle())
@@ -0,0 +1,68 @@
+import io
+import os
+from datetime import datetime
+
+# Модуль выполняется в процессах-отрисовщиках: он не импортирует config, базу
+# и другие модули бота, чтобы процесс-отрисовщик ничего не открывал при запуске
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts')
+
+def register_fonts():
+    # Выполняется один раз при запуске каждого процесса-отрисовщика
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    pdfmetrics.registerFont(TTFont('DejaVuSans', os.path.join(FONTS_DIR, 'DejaVuSans.ttf')))
+    pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', os.path.join(FONTS_DIR, 'DejaVuSans-Bold.ttf')))
+
+def render_report(start, end, by_service, by_day):
+    """Строит PDF-отчёт по записям и выручке. Выполняется в процессе-отрисовщике."""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    title_style = ParagraphStyle('title', fontName='DejaVuSans-Bold', fontSize=16, leading=20, spaceAfter=6)
+    heading_style = ParagraphStyle('heading', fontName='DejaVuSans-Bold', fontSize=12, leading=16, spaceBefore=10, spaceAfter=6)
+    text_style = ParagraphStyle('text', fontName='DejaVuSans', fontSize=10, leading=14)
+    table_style = TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
+        ('FONTNAME', (0, 0), (-1, 0), 'DejaVuSans-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f2d7e6')),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ALIGN', (-2, 1), (-1, -1), 'RIGHT'),
+    ])
+
+    total_count = sum(row[2] for row in by_service)
+    total_revenue = sum(row[3] for row in by_service)
+
+    story = [
+        Paragraph('Отчёт по записям', title_style),
+        Paragraph(f"Период: {start:%d.%m.%Y} — {end:%d.%m.%Y}", text_style),
+        Paragraph(f"Сформирован: {datetime.now():%d.%m.%Y %H:%M}", text_style),
+        Spacer(1, 4 * mm),
+        Paragraph(f"Всего записей: {total_count}, выручка: {total_revenue} руб.", text_style),
+    ]
+
+    if not by_service:
+        story.append(Paragraph('За выбранный период записей нет.', text_style))
+    else:
+        story.append(Paragraph('По услугам', heading_style))
+        rows = [['Категория', 'Услуга', 'Записей', 'Выручка, руб.']]
+        rows += [[category or '—', name or 'Удалённая услуга', count, revenue] for category, name, count, revenue in by_service]
+        table = Table(rows, colWidths=[40 * mm, 70 * mm, 25 * mm, 35 * mm], repeatRows=1)
+        table.setStyle(table_style)
+        story.append(table)
+
+        story.append(Paragraph('По дням', heading_style))
+        rows = [['Дата', 'Записей', 'Выручка, руб.']]
+        rows += [[datetime.strptime(day, '%Y-%m-%d').strftime('%d.%m.%Y'), count, revenue] for day, count, revenue in by_day]
+        table = Table(rows, colWidths=[40 * mm, 25 * mm, 35 * mm], repeatRows=1)
+        table.setStyle(table_style)
+        story.append(table)
+
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, pagesize=A4, title='Отчёт по записям').build(story)
+    return buffer.getvalue()
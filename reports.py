@@ -0,0 +1,61 @@
+import asyncio
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from config import config
+from database import adb
+from tenants import tenant_key
+from report_render import register_fonts, render_report
+
+class ReportService:
+    """Отрисовка PDF в пуле процессов с кэшем по периоду и версии данных."""
+
+    def __init__(self, database, workers=None, cache_size=None):
+        self.database = database
+        self.workers = workers or config.REPORT_WORKERS
+        self.cache_size = cache_size or config.REPORT_CACHE_SIZE
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # fork копировал бы потоки пула базы и журнала и мог зависнуть в дочернем процессе
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=register_fonts
+            )
+        return self._executor
+
+    async def get_pdf(self, start, end):
+        # Кэш и пул процессов общие для всех салонов, поэтому салон входит в ключ
+        key = (tenant_key(), start, end, self.database.data_version)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        # Одинаковые запросы, пришедшие одновременно, ждут одну отрисовку
+        if key not in self._in_flight:
+            self._in_flight[key] = asyncio.ensure_future(self._build(key, start, end))
+        return await asyncio.shield(self._in_flight[key])
+
+    async def _build(self, key, start, end):
+        try:
+            by_service, by_day = await self.database.get_report_data(start.isoformat(), end.isoformat())
+            loop = asyncio.get_running_loop()
+            pdf = await loop.run_in_executor(self._get_executor(), render_report, start, end, by_service, by_day)
+        finally:
+            self._in_flight.pop(key, None)
+
+        self._cache[key] = pdf
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return pdf
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+reports = ReportService(adb)
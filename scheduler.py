@@ -0,0 +1,167 @@
+import json
+import time
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from telegram.error import Forbidden, BadRequest
+from config import config
+from database import adb
+from tenants import TenantLocal
+from broadcast import broadcaster
+
+class Scheduler:
+    """Отложенные задачи, которые хранятся в таблице jobs и переживают перезапуск.
+
+    При старте ожидающие задачи загружаются в кучу (run_at, id); дальше
+    таблица не опрашивается: цикл спит до ближайшей задачи или до сигнала
+    о новой, более ранней. Перед запуском задача захватывается в базе
+    (pending → running), поэтому каждая выполняется не больше одного раза.
+    """
+
+    def __init__(self, database, concurrency=None, batch=None, handlers=None):
+        self.database = database
+        self.concurrency = concurrency or config.SCHEDULER_CONCURRENCY
+        self.batch = batch or config.SCHEDULER_BATCH
+        self.handlers = {} if handlers is None else handlers
+        self._heap = []
+        self._wake = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._running = set()
+        self._task = None
+        self.bot = None
+
+    def register(self, kind, handler):
+        # handler(bot, payload) — корутина; исключение помечает задачу как failed
+        self.handlers[kind] = handler
+
+    async def start(self, bot):
+        self.bot = bot
+        interrupted = await self.database.interrupt_running_jobs()
+        if interrupted:
+            logging.warning(f"{interrupted} scheduled jobs were interrupted by the previous shutdown and will not be retried")
+        self._heap = await self.database.get_pending_jobs()
+        heapq.heapify(self._heap)
+        await schedule_maintenance(self)
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Начатые задачи короткие: даём им закончиться, пока бот ещё доступен
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def schedule(self, kind, run_at, payload=None, dedupe_key=None):
+        """Заводит задачу на момент run_at (datetime). Возвращает id или None, если такая уже есть."""
+        timestamp = run_at.timestamp()
+        job_id = await self.database.add_job(kind, timestamp, json.dumps(payload or {}), dedupe_key)
+        if job_id is not None:
+            heapq.heappush(self._heap, (timestamp, job_id))
+            # Будим цикл, только если новая задача стала ближайшей
+            if self._heap[0][1] == job_id:
+                self._wake.set()
+        return job_id
+
+    async def _loop(self):
+        while True:
+            self._wake.clear()
+            delay = self._heap[0][0] - time.time() if self._heap else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = []
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch:
+                due.append(heapq.heappop(self._heap)[1])
+            try:
+                claimed = await self.database.claim_jobs(due)
+            except Exception as e:
+                logging.error(f"Error claiming scheduled jobs {due}: {e}")
+                # Возвращаем задачи в кучу и пробуем позже
+                for job_id in due:
+                    heapq.heappush(self._heap, (now + 30, job_id))
+                continue
+
+            for job in claimed:
+                await self._semaphore.acquire()
+                task = asyncio.create_task(self._run(*job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _run(self, job_id, kind, run_at, payload):
+        try:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                raise RuntimeError(f"no handler for job kind {kind!r}")
+            await handler(self.bot, json.loads(payload))
+        except Exception as e:
+            logging.error(f"Scheduled job {job_id} ({kind}) failed: {e}")
+            await self.database.finish_job(job_id, 'failed', str(e))
+        else:
+            await self.database.finish_job(job_id, 'done')
+        finally:
+            self._semaphore.release()
+
+# Обработчики задач общие: register на любом салоне добавляет их всем
+JOB_HANDLERS = {}
+scheduler = TenantLocal(lambda tenant: Scheduler(adb, handlers=JOB_HANDLERS))
+
+# Напоминания о визите
+
+async def schedule_reminders(client_id, telegram_id, service_name, starts_at):
+    for hours in config.REMINDER_HOURS:
+        run_at = starts_at - timedelta(hours=hours)
+        if run_at <= datetime.now():
+            continue
+        await scheduler.schedule('reminder', run_at, {
+            'telegram_id': telegram_id,
+            'service': service_name,
+            'starts_at': starts_at.strftime('%Y-%m-%d %H:%M'),
+        }, dedupe_key=f"reminder:{client_id}:{hours:g}")
+
+async def send_reminder(bot, payload):
+    starts_at = datetime.strptime(payload['starts_at'], '%Y-%m-%d %H:%M')
+    # После простоя бота напоминание могло опоздать: о прошедшем визите не пишем
+    if starts_at <= datetime.now():
+        return
+    try:
+        await bot.send_message(
+            chat_id=payload['telegram_id'],
+            text=f"⏰ Напоминаем о записи: {payload['service']}, {starts_at:%d.%m в %H:%M}. Ждём вас!"
+        )
+    except (Forbidden, BadRequest) as e:
+        # Клиент заблокировал бота: повторять бессмысленно
+        logging.warning(f"Reminder to {payload['telegram_id']} was not delivered: {e}")
+
+# Отложенные рассылки
+
+async def run_scheduled_broadcast(bot, payload):
+    await broadcaster.start(bot, payload['message'], payload['admin_id'])
+
+# Ночное обслуживание
+
+async def schedule_maintenance(scheduler):
+    now = datetime.now()
+    run_at = now.replace(hour=config.MAINTENANCE_HOUR, minute=0, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    await scheduler.schedule('maintenance', run_at, dedupe_key=f"maintenance:{run_at:%Y-%m-%d}")
+
+async def run_maintenance(bot, payload):
+    try:
+        before = time.time() - config.JOBS_RETENTION_DAYS * 24 * 3600
+        deleted = await adb.run_maintenance(before)
+        logging.info(f"Nightly maintenance finished, {deleted} old jobs removed")
+    finally:
+        # Следующий запуск заводится, даже если этот завершился ошибкой
+        await schedule_maintenance(scheduler)
+
+scheduler.register('reminder', send_reminder)
+scheduler.register('broadcast', run_scheduled_broadcast)
+scheduler.register('maintenance', run_maintenance)
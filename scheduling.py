@@ -0,0 +1,146 @@
+import time
+import heapq
+import asyncio
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime, timedelta
+from config import config
+from database import adb
+from tenants import TenantLocal
+
+TIME_FORMAT = '%Y-%m-%d %H:%M'
+EPOCH = datetime(2000, 1, 1)
+WEEKDAYS = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+# Как часто перечитывать расписание, если его изменили вне бота (manage.py)
+SCHEDULE_REFRESH = 300
+
+Slot = namedtuple('Slot', 'master_id master_name starts_at ends_at')
+
+def to_minutes(moment):
+    return int((moment - EPOCH).total_seconds()) // 60
+
+def from_minutes(minutes):
+    return EPOCH + timedelta(minutes=minutes)
+
+def parse_time(text):
+    return to_minutes(datetime.strptime(text, TIME_FORMAT))
+
+class IntervalIndex:
+    """Занятые интервалы одного мастера в минутах, отсортированные по началу."""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def add(self, start, end):
+        position = bisect_left(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+
+    def next_free(self, start, duration):
+        """Первая минута не раньше start, с которой свободно duration минут подряд."""
+        position = bisect_right(self.starts, start)
+        if position and self.ends[position - 1] > start:
+            start = self.ends[position - 1]
+        while position < len(self.starts) and self.starts[position] < start + duration:
+            start = max(start, self.ends[position])
+            position += 1
+        return start
+
+class Availability:
+    """Поиск свободных слотов по рабочим часам мастеров и индексу их записей."""
+
+    def __init__(self, database):
+        self.database = database
+        self.masters = {}
+        # master_id -> weekday -> [(начало, конец)] в минутах от полуночи
+        self.hours = {}
+        self.indexes = {}
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+
+    def _is_stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > SCHEDULE_REFRESH
+
+    async def load(self):
+        masters, hours = await self.database.get_schedule()
+        appointments = await self.database.get_appointments(datetime.now().strftime(TIME_FORMAT))
+
+        self.masters = dict(masters)
+        self.hours = {}
+        for master_id, weekday, start, end in hours:
+            self.hours.setdefault(master_id, {}).setdefault(weekday, []).append((start, end))
+        self.indexes = {master_id: IntervalIndex() for master_id in self.masters}
+        for master_id, starts_at, ends_at in appointments:
+            if master_id in self.indexes:
+                # Строки отсортированы по началу, поэтому хватает append
+                index = self.indexes[master_id]
+                index.starts.append(parse_time(starts_at))
+                index.ends.append(parse_time(ends_at))
+        self._loaded_at = time.monotonic()
+
+    async def _ensure_loaded(self):
+        if self._is_stale():
+            async with self._lock:
+                if self._is_stale():
+                    await self.load()
+
+    def _master_slots(self, master_id, duration, after, days):
+        index = self.indexes[master_id]
+        hours = self.hours.get(master_id, {})
+        step = config.SLOT_STEP
+        first_day = from_minutes(after).replace(hour=0, minute=0)
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            day_start = to_minutes(day)
+            for opens, closes in hours.get(day.weekday(), ()):
+                close = day_start + closes
+                candidate = max(day_start + opens, after)
+                while True:
+                    # Начало слота выравнивается по сетке от полуночи
+                    candidate = day_start + -(-(candidate - day_start) // step) * step
+                    if candidate + duration > close:
+                        break
+                    free = index.next_free(candidate, duration)
+                    if free == candidate:
+                        yield candidate, master_id
+                        candidate += step
+                    else:
+                        candidate = free
+
+    async def next_slots(self, duration, count=None, after=None):
+        """Ближайшие count свободных слотов длительностью duration минут по всем мастерам."""
+        await self._ensure_loaded()
+        count = count or config.SLOT_OPTIONS
+        if after is None:
+            after = datetime.now() + timedelta(minutes=config.SLOT_LEAD_TIME)
+        after = to_minutes(after)
+
+        streams = [self._master_slots(master_id, duration, after, config.SLOT_SEARCH_DAYS) for master_id in self.masters]
+        slots = []
+        for start, master_id in heapq.merge(*streams):
+            slots.append(Slot(master_id, self.masters[master_id], from_minutes(start), from_minutes(start + duration)))
+            if len(slots) == count:
+                break
+        return slots
+
+    def label(self, slot):
+        text = f"{WEEKDAYS[slot.starts_at.weekday()]} {slot.starts_at:%d.%m %H:%M}"
+        if len(self.masters) > 1:
+            text += f" — {slot.master_name}"
+        return text
+
+    async def book(self, telegram_id, first_name, phone_number, service_id, master_id, starts_at, ends_at):
+        """Записывает клиента на слот. Возвращает номер записи или None, если слот уже занят."""
+        client_id = await self.database.book_slot(
+            telegram_id, first_name, phone_number, service_id,
+            master_id, starts_at.strftime(TIME_FORMAT), ends_at.strftime(TIME_FORMAT)
+        )
+        if client_id is None:
+            # Слот занят в обход индекса: перечитываем расписание при следующем поиске
+            self._loaded_at = None
+        elif master_id in self.indexes:
+            self.indexes[master_id].add(to_minutes(starts_at), to_minutes(ends_at))
+        return client_id
+
+availability = TenantLocal(lambda tenant: Availability(adb))
@@ -0,0 +1,68 @@
+import threading
+from contextvars import ContextVar
+
+# Салон, чьё обновление или фоновая задача сейчас выполняется; None — обычный режим с одним ботом
+current_tenant = ContextVar('current_tenant', default=None)
+
+class Tenant:
+    """Один салон в многопользовательском режиме: имя, настройки и свои экземпляры сервисов."""
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        # TenantLocal -> экземпляр этого салона
+        self.instances = {}
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f"Tenant({self.name!r})"
+
+class TenantLocal:
+    """Объект уровня модуля, у которого в каждом салоне свой экземпляр.
+
+    Модули по-прежнему импортируют db, adb, catalog и т.д. как раньше; обращение
+    к атрибуту уходит в экземпляр текущего салона из current_tenant. Экземпляр
+    создаётся при первом обращении вызовом factory(tenant), а без салона —
+    factory(None), это обычный режим с одним ботом.
+
+    Фоновые задачи asyncio наследуют салон от задачи, которая их создала, а
+    потоки пула — нет, поэтому в потоки передаются уже полученные экземпляры.
+    """
+
+    __slots__ = ('_factory', '_default', '_lock')
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_default', None)
+        object.__setattr__(self, '_lock', threading.RLock())
+
+    def resolve(self):
+        """Экземпляр текущего салона."""
+        tenant = current_tenant.get()
+        if tenant is None:
+            instance = self._default
+            if instance is None:
+                with self._lock:
+                    if self._default is None:
+                        object.__setattr__(self, '_default', self._factory(None))
+                    instance = self._default
+            return instance
+
+        instance = tenant.instances.get(self)
+        if instance is None:
+            with tenant._lock:
+                instance = tenant.instances.get(self)
+                if instance is None:
+                    instance = tenant.instances[self] = self._factory(tenant)
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+def tenant_key():
+    """Ключ для общих кэшей: имя текущего салона или None."""
+    tenant = current_tenant.get()
+    return tenant.name if tenant is not None else None
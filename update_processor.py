@@ -0,0 +1,77 @@
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from metrics import metrics
+from logs import current_update_id
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Обновления одного чата выполняются строго по очереди, поэтому состояния
+    ConversationHandler не перемешиваются, а разные чаты обрабатываются
+    одновременно в пределах max_concurrent_updates.
+
+    Семафор BaseUpdateProcessor ограничивает обновления, принятые в работу,
+    включая ждущие очереди своего чата; одновременное выполнение ограничивает
+    собственный семафор, который берётся уже после очереди чата.
+    """
+
+    # Сколько обновлений на один слот выполнения может ждать очереди своего чата
+    PENDING_PER_SLOT = 16
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates * self.PENDING_PER_SLOT)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # chat_id -> [lock, число ожидающих обновлений]
+        self._chats = {}
+        self._duration = metrics.histogram('bot_update_duration_seconds')
+    
+    @staticmethod
+    def _chat_key(update):
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+    
+    @asynccontextmanager
+    async def _chat_turn(self, key):
+        entry = self._chats.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[key]
+    
+    async def do_process_update(self, update, coroutine):
+        key = self._chat_key(update)
+        if key is None:
+            await self._run(update, coroutine)
+            return
+        
+        # Сначала очередь чата, затем слот выполнения: очередь одного чата не занимает все слоты
+        async with self._chat_turn(key):
+            await self._run(update, coroutine)
+    
+    async def _run(self, update, coroutine):
+        async with self._slots:
+            # Полное время обновления: все группы обработчиков и запись persistence
+            started = time.perf_counter()
+            # Каждое обновление обрабатывается в своей задаче, поэтому значение не утекает в другие
+            current_update_id.set(getattr(update, 'update_id', None))
+            try:
+                await coroutine
+            finally:
+                self._duration.observe(time.perf_counter() - started)
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
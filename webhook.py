@@ -0,0 +1,130 @@
+import hmac
+import json
+import signal
+import asyncio
+import logging
+from contextlib import contextmanager
+import uvicorn
+from telegram import Update
+from config import config
+
+# Обновления Telegram небольшие; всё, что больше, отбрасываем сразу
+MAX_BODY_SIZE = 1024 * 1024
+
+class WebhookApp:
+    """Минимальное ASGI-приложение: принимает обновления Telegram и кладёт их в update_queue."""
+
+    def __init__(self, application, path=None, secret_token=None, health_path=None):
+        self.application = application
+        self.path = path or config.WEBHOOK_PATH
+        self.secret_token = (secret_token if secret_token is not None else config.WEBHOOK_SECRET).encode()
+        self.health_path = health_path or config.HEALTH_PATH
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+
+        path, method = scope['path'], scope['method']
+        if path == self.health_path and method == 'GET':
+            await self._respond(send, 200, {
+                'status': 'ok' if self.application.running else 'starting',
+                'pending_updates': self.application.update_queue.qsize(),
+            })
+        elif path == self.path and method == 'POST':
+            await self._handle_update(scope, receive, send)
+        else:
+            await self._respond(send, 404, {'error': 'not found'})
+
+    async def _handle_update(self, scope, receive, send):
+        headers = dict(scope['headers'])
+        if self.secret_token:
+            token = headers.get(b'x-telegram-bot-api-secret-token', b'')
+            if not hmac.compare_digest(token, self.secret_token):
+                await self._respond(send, 403, {'error': 'invalid secret token'})
+                return
+
+        body = await self._read_body(receive)
+        if body is None:
+            await self._respond(send, 413, {'error': 'payload too large'})
+            return
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception as e:
+            logging.warning(f"Rejected malformed webhook update: {e}")
+            await self._respond(send, 400, {'error': 'malformed update'})
+            return
+
+        await self.application.update_queue.put(update)
+        await self._respond(send, 200, {'ok': True})
+
+    async def _read_body(self, receive):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > MAX_BODY_SIZE:
+                return None
+            more_body = message.get('more_body', False)
+        return body
+
+    async def _respond(self, send, status, payload):
+        body = json.dumps(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+class WebhookServer(uvicorn.Server):
+    @contextmanager
+    def capture_signals(self):
+        # Сигналы обрабатывает run_webhook, чтобы Application успел корректно остановиться
+        yield
+
+def build_server(app, host=None, port=None):
+    return WebhookServer(uvicorn.Config(
+        app,
+        host=host or config.WEBHOOK_LISTEN,
+        port=port or config.WEBHOOK_PORT,
+        limit_concurrency=config.WEBHOOK_MAX_CONNECTIONS,
+        lifespan='off',
+        log_config=None,
+        access_log=False,
+    ))
+
+async def run_webhook(application):
+    server = build_server(WebhookApp(application))
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, setattr, server, 'should_exit', True)
+        except NotImplementedError:
+            pass
+
+    # Повторяем жизненный цикл run_polling, включая хуки post_init/post_stop/post_shutdown
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+
+        if config.WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET or None,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+            )
+
+        await application.start()
+        try:
+            await server.serve()
+        finally:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+
+    if application.post_shutdown:
+        await application.post_shutdown(application)